@@ -0,0 +1,262 @@
+import re
+from collections import OrderedDict, namedtuple
+from itertools import count
+
+from flask import (request, request_finished, request_started, session,
+                   url_for)
+from flask_login import login_user
+from flask_sqlalchemy import get_debug_queries
+
+from . import db
+from .models import Post, Role, User
+from .pagination import KeysetPagination
+
+SCAN = 'full table scan'
+INDEX_SCAN = 'full index scan'
+SORT = 'temp b-tree for ORDER BY'
+
+# endpoints whose GET requests change data, send emails or log out
+UNSAFE_ENDPOINTS = {
+    'auth.logout', 'auth.resend_confirmation', 'blog.follow',
+    'blog.unfollow', 'blog.comment_enable', 'blog.comment_disable',
+    'info.delete_course', 'info.delete_all_courses',
+}
+
+# numbers the EXPLAIN statements, see explain()
+_explained = count()
+
+Issue = namedtuple('Issue', ['kind', 'table', 'detail'])
+Advice = namedtuple('Advice', ['statement', 'urls', 'plan', 'issues',
+                               'suggestions'])
+
+
+def sample_user():
+    """Return an administrator, who can see every page, or any user."""
+    role = Role.query.filter_by(name='Administrator').first()
+    user = None
+    if role is not None:
+        user = role.users.first()
+    return user or User.query.order_by(User.id).first()
+
+
+def workload_urls(app, user):
+    """Build a URL for every safe GET view, filled in with sample data.
+
+    Returns the URLs and the endpoints that had to be skipped.
+    """
+    post = user.posts.order_by(Post.timestamp.desc()).first() or \
+        Post.query.order_by(Post.timestamp.desc()).first()
+    course = user.courses.first()
+    values = {
+        'username': user.username,
+        ('blog.post', 'id'): post and post.id,
+        ('blog.edit', 'id'): post and post.id,
+        ('blog.edit_profile_admin', 'id'): user.id,
+        ('info.edit_course', 'id'): course and course.id,
+    }
+    urls = []
+    skipped = []
+    with app.test_request_context():
+        for rule in sorted(app.url_map.iter_rules(),
+                           key=lambda rule: rule.endpoint):
+            if rule.endpoint == 'static' or 'GET' not in rule.methods:
+                continue
+            if rule.endpoint in UNSAFE_ENDPOINTS:
+                skipped.append(rule.endpoint)
+                continue
+            kwargs = {}
+            for argument in rule.arguments:
+                kwargs[argument] = values.get((rule.endpoint, argument),
+                                              values.get(argument))
+            if None in kwargs.values():
+                skipped.append(rule.endpoint)
+                continue
+            urls.append(url_for(rule.endpoint, **kwargs))
+            # the index shows the timeline once the cookie is set, also
+            # from a cursor, which pages of one post have for two posts
+            if rule.endpoint == 'blog.show_followed':
+                query, keys = user.timeline_query()
+                cursor = KeysetPagination(query, keys, 1).next_cursor
+                if cursor is not None:
+                    urls.append(url_for('blog.index', cursor=cursor))
+    return urls, skipped
+
+
+def capture_queries(app, user, urls):
+    """Request ``urls`` as ``user`` and record the SELECT statements.
+
+    Returns an ordered mapping of statement to its first parameters and the
+    URLs that issued it.
+    """
+    queries = OrderedDict()
+    # requests share the app context of the command, and so its queries
+    offset = [0]
+
+    def start(sender, **extra):
+        offset[0] = len(get_debug_queries())
+
+    def record(sender, response, **extra):
+        for query in get_debug_queries()[offset[0]:]:
+            if not query.statement.lstrip().upper().startswith('SELECT'):
+                continue
+            if query.statement not in queries:
+                queries[query.statement] = (query.parameters, [])
+            if request.path not in queries[query.statement][1]:
+                queries[query.statement][1].append(request.path)
+
+    # log in with the same remote address and user agent as the client
+    client = app.test_client()
+    with app.test_request_context(environ_base=client.environ_base):
+        login_user(user)
+        data = dict(session)
+    with client.session_transaction() as client_session:
+        client_session.update(data)
+    with request_started.connected_to(start, app), \
+            request_finished.connected_to(record, app):
+        for url in urls:
+            client.get(url, follow_redirects=True)
+    return queries
+
+
+def explain(statement, parameters):
+    """Return the query plan of ``statement`` as a list of lines."""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif dialect == 'postgresql':
+        prefix = 'EXPLAIN '
+    else:
+        raise ValueError('cannot explain queries on %s' % dialect)
+    # the driver caches prepared statements by their text, and sqlite
+    # replays a cached EXPLAIN even after the indexes changed, so every
+    # EXPLAIN is made unique for single connection pools
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('%s%s /* %d */' % (prefix, statement,
+                                          next(_explained)), parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def _table(name):
+    """Resolve a table name or an alias such as ``users_1`` to a table."""
+    tables = db.metadata.tables
+    if name in tables:
+        return name
+    match = re.match(r'^(\w+)_\d+$', name)
+    if match and match.group(1) in tables:
+        return match.group(1)
+    return None
+
+
+def plan_issues(plan, dialect='sqlite'):
+    """Find full table scans and sorts in a plan from ``explain``."""
+    issues = []
+    for line in plan:
+        if dialect == 'sqlite':
+            scan = re.match(r'^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?', line)
+            sort = 'USE TEMP B-TREE FOR' in line and 'ORDER BY' in line
+        else:
+            scan = re.search(r'Seq Scan on (\w+)', line)
+            sort = re.match(r'^\s*(?:->\s*)?Sort\s+\(', line)
+        if scan and _table(scan.group(1)):
+            kind = INDEX_SCAN if 'INDEX' in line[scan.end():] else SCAN
+            issues.append(Issue(kind, _table(scan.group(1)), line.strip()))
+        elif sort:
+            issues.append(Issue(SORT, None, line.strip()))
+    return issues
+
+
+def _ordered_columns(statement):
+    """Return the ``(table, column)`` pairs after ORDER BY."""
+    match = re.search(r'\bORDER BY\b(.*?)(?:\bLIMIT\b|\bOFFSET\b|$)',
+                      statement, re.S)
+    if not match:
+        return []
+    return [(_table(name), column) for name, column in
+            re.findall(r'(\w+)\."?(\w+)"?', match.group(1))
+            if _table(name)]
+
+
+def suggest_index(statement, table, sort=False):
+    """Guess an index on ``table`` that would serve ``statement``.
+
+    The equality columns, or else the join columns, come first, then the
+    ORDER BY columns or else the first range column. Without such a column
+    an index is only suggested for the ORDER BY of a ``sort``, since
+    scanning a range of most of the table is no cheaper through an index.
+    Returns ``None`` when there is nothing to suggest or when an index
+    already starts with the suggested columns.
+    """
+    qualified = r'(\w+)\."?(\w+)"?'
+    value = r'\s*(?:=|\bIN\b)\s*(?:\?|%\(|:\w|\(|\d|\')'
+    parameter = r'(?:\?|%\(\w+\)s|:\w+|\d+)\s*=\s*'
+    equal = re.findall(qualified + value, statement)
+    equal += re.findall(parameter + qualified, statement)
+    joined = []
+    for pair in re.findall(qualified + r'\s*=\s*' + qualified, statement):
+        joined += [pair[:2], pair[2:]]
+    ranges = re.findall(qualified + r'\s*(?:<|>|\bBETWEEN\b)', statement)
+    columns = []
+    for name, column in equal:
+        if _table(name) == table and column not in columns:
+            columns.append(column)
+    # a table filtered by values drives the join, otherwise it is joined to
+    if not columns:
+        for name, column in joined:
+            if _table(name) == table and column not in columns:
+                columns.append(column)
+    ordered = [column for other, column in _ordered_columns(statement)
+               if other == table and column not in columns]
+    if not columns and not (sort and ordered):
+        return None
+    if ordered:
+        columns += ordered
+    else:
+        columns += [column for other, column in ranges
+                    if _table(other) == table and column not in columns][:1]
+    # look at the database rather than the models, which may be ahead of it
+    inspector = db.inspect(db.engine)
+    existing = [index['column_names']
+                for index in inspector.get_indexes(table)]
+    existing.append(inspector.get_pk_constraint(table)['constrained_columns'])
+    for index in existing:
+        if index[:len(columns)] == columns:
+            return None
+    return table, tuple(columns)
+
+
+def advise(queries):
+    """Explain every captured query and suggest indexes for its issues."""
+    dialect = db.engine.dialect.name
+    result = []
+    for statement, (parameters, urls) in queries.items():
+        plan = explain(statement, parameters)
+        issues = plan_issues(plan, dialect)
+        suggestions = []
+        tables = set(issue.table for issue in issues if issue.table)
+        sort = any(issue.kind == SORT for issue in issues)
+        if sort:
+            tables.update(table for table, _ in _ordered_columns(statement))
+        for table in sorted(tables):
+            suggestion = suggest_index(statement, table, sort)
+            if suggestion and suggestion not in suggestions:
+                suggestions.append(suggestion)
+        result.append(Advice(statement, urls, plan, issues, suggestions))
+    return result
+
+
+def merge_suggestions(suggestions):
+    """Drop the suggestions that are a prefix of another one."""
+    return [(table, columns) for table, columns in suggestions
+            if not any(other != columns and other[:len(columns)] == columns
+                       for other_table, other in suggestions
+                       if other_table == table)]
+
+
+def index_ddl(suggestion):
+    table, columns = suggestion
+    return 'CREATE INDEX ix_%s_%s ON %s (%s)' % (
+        table, '_'.join(columns), table, ', '.join(columns))
@@ -2,7 +2,7 @@ from flask import Blueprint
 
 blog = Blueprint('blog', __name__)
 
-from . import views
+from . import fragments, views
 from ..models import Permission
 
 
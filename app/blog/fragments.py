@@ -0,0 +1,57 @@
+from flask import render_template
+from flask_login import current_user
+from jinja2 import Markup
+
+from . import blog
+from ..models import Comment, Permission, Post
+
+
+def _cached(cache, key, version, render):
+    """Return the cached fragment of ``key``, rendering it when stale.
+
+    ``version`` holds everything the fragment shows, so a fragment is only
+    reused while its item is unchanged, even when another process changed
+    the item.
+    """
+    entry = cache.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    html = Markup(render())
+    cache.set(key, (version, html))
+    return html
+
+
+@blog.app_template_global()
+def render_post(post):
+    """Render a post view of ``load_posts`` for the current user."""
+    if current_user.is_authenticated and post.author is not None and \
+            current_user.id == post.author.id:
+        role = 'author'
+    elif current_user.is_administrator():
+        role = 'administrator'
+    else:
+        role = 'reader'
+    return _cached(Post.fragment_cache, (post.id, role), post,
+                   lambda: render_template('blog/_post.html', post=post,
+                                           role=role))
+
+
+@blog.app_template_global()
+def render_comment(index, comment, post_id, cursor=None):
+    """Render a comment with its floor number for the current user.
+
+    The moderation links return to the page of ``cursor``.
+    """
+    if current_user.can(Permission.MODERATE):
+        role = 'moderator'
+    else:
+        role = 'reader'
+        cursor = None
+    author = comment.author
+    version = (index, post_id, cursor, comment.body, comment.body_html,
+               comment.disabled, comment.timestamp, author.username,
+               author.avatar_hash)
+    return _cached(Comment.fragment_cache, (comment.id, role), version,
+                   lambda: render_template(
+                       'blog/_comment.html', index=index, comment=comment,
+                       post_id=post_id, cursor=cursor, role=role))
@@ -0,0 +1,31 @@
+from collections import namedtuple
+
+from ..models import User
+
+AuthorView = namedtuple('AuthorView', ['id', 'username', 'avatar'])
+
+PostView = namedtuple('PostView', ['id', 'body', 'body_html', 'timestamp',
+                                   'author', 'comment_count'])
+
+
+def load_posts(posts, avatar_size=40):
+    """Return the views of a page of posts for the post templates.
+
+    The authors are loaded with one IN query and the comment counts are
+    read from the posts, so a page costs the same number of queries however
+    many posts it has, and rendering it none.
+    """
+    posts = list(posts)
+    if not posts:
+        return []
+    author_ids = set(post.author_id for post in posts
+                     if post.author_id is not None)
+    authors = {}
+    if author_ids:
+        authors = {
+            user.id: AuthorView(user.id, user.username,
+                                user.gravatar(size=avatar_size))
+            for user in User.query.filter(User.id.in_(author_ids))}
+    return [PostView(post.id, post.body, post.body_html, post.timestamp,
+                     authors.get(post.author_id), post.comment_count or 0)
+            for post in posts]
@@ -5,8 +5,10 @@ from flask_login import current_user, login_required
 from . import blog
 from .. import db
 from ..decorators import admin_required, permission_required
-from ..models import Permission, Post, Role, User, Comment
+from ..models import Comment, Follow, Permission, Post, Role, User
+from ..pagination import KeysetPagination
 from .forms import CommentForm, EditProfileAdminForm, EditProfileForm, PostForm
+from .loaders import load_posts
 
 
 @blog.route('/index', methods=['GET', 'POST'])
@@ -18,19 +20,17 @@ def index():
         db.session.add(post)
         db.session.commit()
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
     show_followed = False
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
     if show_followed:
-        query = current_user.followed_posts.union(
-            Post.query.filter_by(author_id=current_user.id))
+        query, keys = current_user.timeline_query()
     else:
-        query = Post.query
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['APP_POSTS_PER_PAGE'],
-        error_out=False)
-    posts = pagination.items
+        query, keys = Post.query, [(Post.timestamp, True), (Post.id, True)]
+    pagination = KeysetPagination(
+        query, keys, per_page=current_app.config['APP_POSTS_PER_PAGE'],
+        cursor=request.args.get('cursor'))
+    posts = load_posts(pagination.items)
     return render_template('blog/index.html', form=form, posts=posts,
                            show_followed=show_followed, pagination=pagination)
 
@@ -38,11 +38,11 @@ def index():
 @blog.route('/user/<username>')
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['APP_POSTS_PER_PAGE'],
-        error_out=False)
-    posts = pagination.items
+    pagination = KeysetPagination(
+        user.posts, [(Post.timestamp, True), (Post.id, True)],
+        per_page=current_app.config['APP_POSTS_PER_PAGE'],
+        cursor=request.args.get('cursor'), total=user.post_count)
+    posts = load_posts(pagination.items)
     return render_template('blog/user.html', user=user, posts=posts,
                            pagination=pagination)
 
@@ -104,17 +104,18 @@ def post(id):
         db.session.add(comment)
         db.session.commit()
         flash('评论成功。')
-        return redirect(url_for('.post', id=post.id, page=-1))
-    comments_per_page = current_app.config['APP_COMMENTS_PER_PAGE']
-    page = request.args.get('page', 1, type=int)
-    if page == -1:
-        page = (post.comments.count() - 1) // comments_per_page + 1
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page, per_page=comments_per_page, error_out=False)
-    comments = [(comments_per_page * (page - 1) + 1 + index, item)
+        return redirect(url_for('.post', id=post.id, cursor='last'))
+    pagination = KeysetPagination(
+        post.comments.options(db.joinedload(Comment.author)),
+        [(Comment.timestamp, False), (Comment.id, False)],
+        per_page=current_app.config['APP_COMMENTS_PER_PAGE'],
+        cursor=request.args.get('cursor'), total=post.comment_count)
+    # the floor numbers continue from the comments before the page
+    comments = [((pagination.first or 1) + index, item)
                 for index, item in enumerate(pagination.items)]
-    return render_template('blog/post.html', posts=[post], form=form,
-                           comments=comments, pagination=pagination)
+    return render_template('blog/post.html', posts=load_posts([post]),
+                           form=form, comments=comments,
+                           pagination=pagination)
 
 
 @blog.route('/edit/<int:id>', methods=['GET', 'POST'])
@@ -175,10 +176,10 @@ def followers(username):
     if user is None:
         flash('用户不存在。')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followers.paginate(
-        page, per_page=current_app.config['APP_FOLLOWERS_PER_PAGE'],
-        error_out=False)
+    pagination = KeysetPagination(
+        user.followers, [(Follow.timestamp, True), (Follow.follower_id, True)],
+        per_page=current_app.config['APP_FOLLOWERS_PER_PAGE'],
+        cursor=request.args.get('cursor'), total=user.follower_count)
     follows = [{'user': item.follower, 'timestamp': item.timestamp}
                for item in pagination.items]
     return render_template('blog/followers.html', user=user,
@@ -192,10 +193,10 @@ def followed_by(username):
     if user is None:
         flash('用户不存在。')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed.paginate(
-        page, per_page=current_app.config['APP_FOLLOWERS_PER_PAGE'],
-        error_out=False)
+    pagination = KeysetPagination(
+        user.followed, [(Follow.timestamp, True), (Follow.followed_id, True)],
+        per_page=current_app.config['APP_FOLLOWERS_PER_PAGE'],
+        cursor=request.args.get('cursor'), total=user.followed_count)
     follows = [{'user': item.followed, 'timestamp': item.timestamp}
                for item in pagination.items]
     return render_template('blog/followers.html', user=user,
@@ -230,8 +231,8 @@ def comment_enable(id):
     post_id = request.args.get('post_id', type=int)
     if post_id is None:
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    return redirect(url_for('.post', id=post_id, page=page))
+    return redirect(url_for('.post', id=post_id,
+                            cursor=request.args.get('cursor')))
 
 
 @blog.route('/comment-disable/<int:id>')
@@ -245,5 +246,5 @@ def comment_disable(id):
     post_id = request.args.get('post_id', type=int)
     if post_id is None:
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    return redirect(url_for('.post', id=post_id, page=page))
+    return redirect(url_for('.post', id=post_id,
+                            cursor=request.args.get('cursor')))
@@ -0,0 +1,114 @@
+import csv
+
+import numpy as np
+
+from .. import db
+from ..models import Course, CourseStatistics, CourseType, User
+
+GPA_LABELS = ('综合GPA', '专业GPA', '保研GPA')
+HEADER = ['user_id', 'username'] + list(CourseStatistics().summary())
+
+# number of course rows fetched from the database at a time
+CHUNK_SIZE = 10000
+
+
+def load_courses(term_from=1, term_to=8):
+    """Stream the courses into a ``(user_id, type_id, credit, score)`` array.
+
+    Courses without a type are left out, as from the course statistics.
+    Missing credits and scores are loaded as zeros.
+    """
+    query = db.session.query(
+        Course.user_id, Course.type_id, Course.credit, Course.score).filter(
+        Course.user_id.isnot(None), Course.type_id.isnot(None),
+        Course.term.between(term_from, term_to)).yield_per(CHUNK_SIZE)
+    chunks = []
+    rows = []
+    for row in query:
+        rows.append(row)
+        if len(rows) == CHUNK_SIZE:
+            chunks.append(np.array(rows, dtype=float))
+            rows = []
+    if rows:
+        chunks.append(np.array(rows, dtype=float))
+    if not chunks:
+        return np.zeros((0, 4))
+    return np.nan_to_num(np.concatenate(chunks))
+
+
+def _average(weighted_scores, credits, types):
+    sum_score = weighted_scores[:, types].sum(axis=1)
+    sum_credit = credits[:, types].sum(axis=1)
+    average = np.zeros(len(sum_credit))
+    np.divide(sum_score, sum_credit, out=average, where=sum_credit != 0)
+    return average / 20
+
+
+def batch_statistics(term_from=1, term_to=8):
+    """Compute the statistics of every user at once.
+
+    Returns a list of rows matching ``HEADER``, with the same figures as
+    ``CourseStatistics.summary`` for each user.
+    """
+    users = db.session.query(User.id, User.username).order_by(User.id).all()
+    if not users:
+        return []
+    user_ids = np.array([user.id for user in users], dtype=float)
+    courses = load_courses(term_from, term_to)
+
+    # keep the courses of known users only
+    index = np.searchsorted(user_ids, courses[:, 0])
+    known = (index < len(user_ids)) & \
+        (user_ids[np.minimum(index, len(user_ids) - 1)] == courses[:, 0])
+    index = index[known]
+    courses = courses[known]
+
+    # unknown course types share column 0, which counts towards the totals
+    # but none of the per type columns
+    width = CourseType.PRO_OPTIONAL + 1
+    types = courses[:, 1].astype(int)
+    types[(types < 1) | (types >= width)] = 0
+    cells = index * width + types
+    size = len(users) * width
+    credit = courses[:, 2]
+    weighted_scores = np.bincount(cells, weights=credit * courses[:, 3],
+                                  minlength=size).reshape(-1, width)
+    credits = np.bincount(cells, weights=credit,
+                          minlength=size).reshape(-1, width)
+    counts = np.bincount(cells, minlength=size).reshape(-1, width)
+
+    all_types = list(range(width))
+    reading_count = counts[:, CourseType.READING]
+    reading_credit = np.where(reading_count >= 6, 2, 0)
+    columns = [
+        _average(weighted_scores, credits, all_types),
+        _average(weighted_scores, credits, list(CourseType.academic_type())),
+        _average(weighted_scores, credits,
+                 list(CourseType.postgraduate_recommandation_type())),
+        reading_count,
+        credits[:, CourseType.GENERAL] + reading_credit,
+        credits[:, CourseType.PUBLIC_BASIC] +
+        credits[:, CourseType.PUBLIC_BASIC_MATHS_PHYSICS],
+        credits[:, CourseType.PUBLIC_OPTIONAL],
+        credits[:, CourseType.PRO_BASIC],
+        credits[:, CourseType.PRO_CORE],
+        credits[:, CourseType.PRO_OPTIONAL],
+        credits.sum(axis=1) + reading_credit
+    ]
+
+    rows = []
+    for i, user in enumerate(users):
+        row = [user.id, user.username]
+        for label, column in zip(HEADER[2:], columns):
+            if label in GPA_LABELS:
+                row.append('%.3f' % column[i])
+            else:
+                row.append('%d' % round(column[i]))
+        rows.append(row)
+    return rows
+
+
+def write_csv(f, rows):
+    writer = csv.writer(f)
+    writer.writerow(HEADER)
+    writer.writerows(rows)
@@ -0,0 +1,157 @@
+import os
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from flask import current_app
+
+from .. import db
+from ..cache import LRUCache
+from ..models import Course
+
+
+def _lock_file(f):
+    """Lock an open file until it is closed, OSError if it is locked."""
+    if os.name == 'nt':
+        import msvcrt
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+class ImportJob:
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    def __init__(self, user_id, term, path):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.term = term
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.status = ImportJob.PENDING
+        self.progress = 0.0
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.error = None
+        self.future = None
+
+    @property
+    def done(self):
+        return self.status in (ImportJob.FINISHED, ImportJob.FAILED)
+
+    def update(self, result):
+        self.inserted, self.updated, self.skipped, self.failed = result
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'term': self.term,
+            'status': self.status,
+            'done': self.done,
+            'progress': round(self.progress, 3),
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'error': self.error
+        }
+
+
+class ImportJobQueue:
+    """Runs transcript imports in a thread pool.
+
+    Uploads are spooled to disk first so the request can return at once,
+    and the jobs are kept in memory for the courses page to poll. Other
+    processes cannot see the jobs, so the app must be served by a single
+    worker process (see the Procfile). The queue enforces this with a lock
+    on its spool directory, and removes the files of jobs whose process
+    died when it starts.
+    """
+
+    def __init__(self, capacity=1000):
+        self.jobs = LRUCache(capacity)
+        self._executor = None
+        self._spool_dir = None
+        self._spool_lock = None
+        self._lock = Lock()
+
+    def _get_executor(self, app):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    app.config['APP_IMPORT_WORKERS'])
+            return self._executor
+
+    def _get_spool_dir(self, app):
+        with self._lock:
+            if self._spool_dir is None:
+                spool_dir = os.path.join(
+                    app.config['APP_IMPORT_SPOOL_DIR'] or
+                    tempfile.gettempdir(), 'stuhub-imports')
+                os.makedirs(spool_dir, exist_ok=True)
+                spool_lock = open(os.path.join(spool_dir, '.lock'), 'w')
+                try:
+                    _lock_file(spool_lock)
+                except OSError:
+                    spool_lock.close()
+                    raise RuntimeError(
+                        'import jobs are kept in memory, another process '
+                        'is running them from %s' % spool_dir)
+                # left behind by a process that died while importing
+                for name in os.listdir(spool_dir):
+                    if name.endswith('.html'):
+                        os.remove(os.path.join(spool_dir, name))
+                self._spool_lock = spool_lock
+                self._spool_dir = spool_dir
+            return self._spool_dir
+
+    def submit(self, user_id, term, stream):
+        app = current_app._get_current_object()
+        fd, path = tempfile.mkstemp(suffix='.html',
+                                    dir=self._get_spool_dir(app))
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(stream, f)
+        job = ImportJob(user_id, term, path)
+        self.jobs.set(job.id, job)
+        job.future = self._get_executor(app).submit(self._run, app, job)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    @staticmethod
+    def _run(app, job):
+        with app.app_context():
+            job.status = ImportJob.RUNNING
+            try:
+                with open(job.path, 'rb') as f:
+                    def progress(result):
+                        job.update(result)
+                        if job.size:
+                            job.progress = min(f.tell() / job.size, 1.0)
+                    result = Course.bulk_import(
+                        job.user_id, job.term,
+                        Course.iter_transcript_rows(f), progress=progress)
+                db.session.commit()
+                job.update(result)
+                job.progress = 1.0
+                job.status = ImportJob.FINISHED
+            except Exception as e:
+                db.session.rollback()
+                job.error = str(e)
+                job.status = ImportJob.FAILED
+                app.logger.exception('Import job %s failed' % job.id)
+            finally:
+                db.session.remove()
+                os.remove(job.path)
+
+
+import_jobs = ImportJobQueue()
@@ -1,11 +1,17 @@
-from flask import (current_app, flash, redirect, render_template, request,
-                   url_for)
+import io
+
+from flask import (abort, current_app, flash, jsonify, make_response,
+                   redirect, render_template, request, url_for)
 from flask_login import current_user, login_required
 
 from . import info
 from .. import db
-from ..models import Course, CourseType
+from ..decorators import admin_required
+from ..pagination import KeysetPagination
+from ..models import (Course, CourseScoreBin, CourseType, GPARanking,
+                      TermPrefixSums, gpa_ranking)
 from .forms import CourseForm, ImportCourseForm, TermRangeForm
+from .jobs import import_jobs
 
 
 @info.route('/courses', methods=['GET', 'POST'])
@@ -26,13 +32,17 @@ def courses():
     form.term.data = request.args.get('term', 1, type=int)
     form.type_id.data = request.args.get(
         'type_id', CourseType.GENERAL, type=int)
-    page = request.args.get('page', 1, type=int)
-    courses_per_page = current_app.config['APP_COURSES_PER_PAGE']
-    pagination = current_user.courses.order_by(Course.term.desc()).order_by(
-        Course.type_id.asc()).paginate(page, per_page=courses_per_page, error_out=False)
+    prefix_sums = TermPrefixSums.for_user(current_user.id)
+    pagination = KeysetPagination(
+        current_user.courses,
+        [(Course.term, True), (Course.type_id, False), (Course.id, False)],
+        per_page=current_app.config['APP_COURSES_PER_PAGE'],
+        cursor=request.args.get('cursor'),
+        total=prefix_sums.total().count())
     courses = pagination.items
     return render_template('/info/courses.html', form=form,
-                           courses=courses, pagination=pagination)
+                           courses=courses, pagination=pagination,
+                           import_job=request.args.get('import_job'))
 
 
 @info.route('/edit-course/<int:id>', methods=['GET', 'POST'])
@@ -41,6 +51,14 @@ def edit_course(id):
     course = Course.query.get_or_404(id)
     form = CourseForm()
     if form.validate_on_submit():
+        # a term holds a catalog course once, see ix_courses_fingerprint
+        if course.catalog_id is not None and Course.query.filter(
+                Course.user_id == course.user_id,
+                Course.term == form.term.data,
+                Course.catalog_id == course.catalog_id,
+                Course.id != course.id).first() is not None:
+            flash('The term already has this course.')
+            return render_template('/info/edit_course.html', form=form)
         course.name = form.name.data
         course.term = form.term.data
         course.type_id = form.type_id.data
@@ -70,8 +88,7 @@ def delete_course(id):
 @info.route('/delete-all-courses', methods=['GET'])
 @login_required
 def delete_all_courses():
-    for course in current_user.courses.all():
-        db.session.delete(course)
+    Course.bulk_delete([current_user.id])
     db.session.commit()
     flash('删除成功')
     return redirect(url_for('.courses'))
@@ -82,36 +99,31 @@ def delete_all_courses():
 def import_courses():
     form = ImportCourseForm()
     if form.validate_on_submit():
-        markup = request.files[form.file.name].read().decode('utf-8')
-        for course in Course.fetch_courses(markup):
-            course.term = form.term.data
-            course.user = current_user._get_current_object()
-            db.session.add(course)
-        db.session.commit()
-        return redirect(url_for('.courses'))
+        job = import_jobs.submit(current_user.id, form.term.data,
+                                 request.files[form.file.name].stream)
+        return redirect(url_for('.courses', import_job=job.id))
     return render_template('/info/import_courses.html', form=form)
 
 
+@info.route('/import-jobs/<job_id>')
+@login_required
+def import_job(job_id):
+    job = import_jobs.get(job_id)
+    if job is None or job.user_id != current_user.id:
+        abort(404)
+    return jsonify(job.to_json())
+
+
 @info.route('/import-courses-helper')
 def import_courses_helper():
     return render_template('/info/import_courses_helper.html')
 
 
-def get_statistics(user, terms):
-    courses = user.courses.filter(Course.term.in_(terms)).all()
-    return {
-        '综合GPA': '%.3f' % Course.comprehensive_gpa(courses),
-        '专业GPA': '%.3f' % Course.academic_gpa(courses),
-        '保研GPA': '%.3f' % Course.postgraduate_recommandation_gpa(courses),
-        '已完成经典阅读': '%d' % Course.reading_count(courses),
-        '14通识学分': str(Course.general_course_credit(courses)),
-        '通修学分': str(Course.public_basic_credit(courses)),
-        '公选学分': str(Course.public_optional_credit(courses)),
-        '专业平台学分': str(Course.pro_basic_credit(courses)),
-        '专业核心学分': str(Course.pro_core_credit(courses)),
-        '专业选修学分': str(Course.pro_optional_credit(courses)),
-        '总学分': str(Course.total_credit(courses))
-    }
+def get_statistics(user, term_from, term_to):
+    if term_from > term_to:
+        raise ValueError('term_from must not be after term_to')
+    prefix_sums = TermPrefixSums.for_user(user.id)
+    return prefix_sums.range(term_from, term_to).summary()
 
 
 @info.route('/statistics', methods=['GET', 'POST'])
@@ -123,7 +135,171 @@ def statistics():
                                 term_to=form.term_to.data))
     form.term_from.data = request.args.get('term_from', 1, type=int)
     form.term_to.data = request.args.get('term_to', 8, type=int)
-    terms = list(range(form.term_from.data, form.term_to.data + 1))
-    statistics = get_statistics(current_user, terms)
+    try:
+        statistics = get_statistics(current_user, form.term_from.data,
+                                    form.term_to.data)
+    except ValueError:
+        abort(400)
     return render_template('/info/statistics.html', form=form,
                            statistics=statistics)
+
+
+@info.route('/statistics/trajectory')
+@login_required
+def statistics_trajectory():
+    prefix_sums = TermPrefixSums.for_user(current_user.id)
+    return jsonify({'terms': prefix_sums.trajectory()})
+
+
+@info.route('/statistics/compare')
+@login_required
+def compare_statistics():
+    ranges = TermPrefixSums.for_user(current_user.id).all_ranges()
+    return render_template('/info/compare_statistics.html',
+                           ranges=sorted(ranges.items()))
+
+
+@info.route('/ranking')
+@login_required
+def ranking():
+    return jsonify(gpa_ranking.rank(current_user.id) or {})
+
+
+def bad_request(message):
+    response = jsonify({'error': 'bad request', 'message': message})
+    response.status_code = 400
+    return response
+
+
+def _number(data, key, low, high, default=None):
+    value = data.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or \
+            not low <= value <= high:
+        raise ValueError('%s must be a number from %s to %s'
+                         % (key, low, high))
+    return value
+
+
+def _integer(data, key, low, high, default=None):
+    value = _number(data, key, low, high, default)
+    if not isinstance(value, int):
+        raise ValueError('%s must be an integer from %s to %s'
+                         % (key, low, high))
+    return value
+
+
+@info.route('/what-if', methods=['POST'])
+@login_required
+def what_if():
+    """Project the GPAs of the current user with hypothetical courses.
+
+    Takes ``courses``, a list of ``credit``, ``type_id`` and optional
+    ``score``, and optionally a ``target`` GPA for a ``metric``. Courses
+    with a score are added to the cached statistics of the user; for the
+    target, the average score needed on the courses without a score, or on
+    all of them if every course has one, is solved for.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return bad_request('expected a JSON object')
+    courses = data.get('courses', [])
+    metric = data.get('metric', 'comprehensive')
+    if not isinstance(courses, list) or len(courses) > \
+            current_app.config['APP_WHAT_IF_MAX_COURSES']:
+        return bad_request('courses must be a list of at most %d courses'
+                           % current_app.config['APP_WHAT_IF_MAX_COURSES'])
+    if metric not in GPARanking.METRICS:
+        return bad_request('unknown metric: %s' % metric)
+    prefix_sums = TermPrefixSums.for_user(current_user.id)
+    first_term, last_term = prefix_sums.first_term, prefix_sums.last_term
+    try:
+        term_from = _integer(data, 'term_from', first_term, last_term,
+                             first_term)
+        term_to = _integer(data, 'term_to', first_term, last_term, last_term)
+        if term_from > term_to:
+            raise ValueError('term_from must not be after term_to')
+        target = None
+        if data.get('target') is not None:
+            target = _number(data, 'target', 0, 5)
+        hypothetical = []
+        for course in courses:
+            if not isinstance(course, dict):
+                raise ValueError('every course must be an object')
+            score = None
+            if course.get('score') is not None:
+                score = _number(course, 'score', 0, 100)
+            hypothetical.append((
+                _integer(course, 'type_id', 1, CourseType.PRO_OPTIONAL),
+                _number(course, 'credit', 0, 100), score))
+    except ValueError as e:
+        return bad_request(str(e))
+
+    current = prefix_sums.range(term_from, term_to)
+    projected = current.copy()
+    unscored = []
+    for type_id, credit, score in hypothetical:
+        if score is None:
+            unscored.append((type_id, credit))
+        else:
+            projected.add(type_id, credit * score, credit)
+    result = {
+        'current': {name: gpa(current)
+                    for name, gpa in GPARanking.METRICS.items()},
+        'projected': {name: gpa(projected)
+                      for name, gpa in GPARanking.METRICS.items()},
+    }
+    if target is not None:
+        types = GPARanking.METRIC_TYPES[metric]
+        base = projected
+        if not unscored:
+            base = current
+            unscored = [(type_id, credit)
+                        for type_id, credit, _ in hypothetical]
+        credit = sum(credit for type_id, credit in unscored
+                     if types is None or type_id in types)
+        required = base.required_score(target, credit, types)
+        result.update(metric=metric, target=target, required_score=required,
+                      reachable=required is not None and required <= 100)
+    return jsonify(result)
+
+
+@info.route('/courses/<int:id>/distribution')
+@login_required
+def course_distribution(id):
+    """Return the score distribution of everyone who took a course.
+
+    The distribution is read from the precomputed score bins of the catalog
+    course, and locates the score of the current user within it.
+    ``width`` sets the width of the returned bins, 10 points by default.
+    Courses taken by fewer than ``APP_MIN_COHORT_SIZE`` students only get
+    their count.
+    """
+    course = Course.query.get_or_404(id)
+    if course.user_id != current_user.id:
+        abort(403)
+    if course.catalog_id is None:
+        abort(404)
+    width = request.args.get('width', 10, type=int)
+    if not 1 <= width <= 100:
+        return bad_request('width must be a number from 1 to 100')
+    result = CourseScoreBin.distribution(course.catalog_id).to_json(
+        width, course.score, current_app.config['APP_MIN_COHORT_SIZE'])
+    result['course'] = {'id': course.id, 'code': course.code,
+                        'name': course.name}
+    return jsonify(result)
+
+
+@info.route('/statistics/export')
+@login_required
+@admin_required
+def export_statistics():
+    from .batch import batch_statistics, write_csv
+    term_from = request.args.get('term_from', 1, type=int)
+    term_to = request.args.get('term_to', 8, type=int)
+    f = io.StringIO()
+    write_csv(f, batch_statistics(term_from, term_to))
+    response = make_response('\ufeff' + f.getvalue())
+    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+    response.headers['Content-Disposition'] = \
+        'attachment; filename=statistics.csv'
+    return response
@@ -1,15 +1,32 @@
+import codecs
 import hashlib
+import io
+import re
+from bisect import bisect_left, bisect_right, insort
+from collections import namedtuple
 from datetime import datetime
+from itertools import islice
+from threading import Lock
 
 import bleach
-from bs4 import BeautifulSoup
+from blinker import Namespace
 from flask import current_app, request
 from flask_login import AnonymousUserMixin, UserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from lxml import etree
 from markdown import markdown
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.hybrid import hybrid_property
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from . import db, login_manager
+from .cache import LRUCache
+from .profiles import UniversityProfile, get_profile, register_profile
+
+signals = Namespace()
+
+# sent after a commit that changed courses, with the ids of their users
+courses_changed = signals.signal('courses-changed')
 
 
 class Permission:
@@ -75,6 +92,13 @@ class Role(db.Model):
 
 class Follow(db.Model):
     __tablename__ = 'follows'
+    __table_args__ = (
+        # the other id settles the order of the pages of follows
+        db.Index('ix_follows_follower_timestamp', 'follower_id', 'timestamp',
+                 'followed_id'),
+        db.Index('ix_follows_followed_timestamp', 'followed_id', 'timestamp',
+                 'follower_id'),
+    )
     follower_id = db.Column(db.Integer, db.ForeignKey('users.id'),
                             primary_key=True)
     followed_id = db.Column(db.Integer, db.ForeignKey('users.id'),
@@ -96,6 +120,21 @@ class User(UserMixin, db.Model):
     member_since = db.Column(db.DateTime(), default=datetime.utcnow)
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
     avatar_hash = db.Column(db.String(32))
+    # the posts of users with many followers are not copied to the
+    # timelines of the followers, they are merged in when reading
+    fan_out_posts = db.Column(db.Boolean, default=True)
+    # counters maintained by the model events, see recount()
+    post_count = db.Column(db.Integer, nullable=False, default=0,
+                           server_default='0')
+    follower_count = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
+    followed_count = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
+    # the CourseRevision of the last transaction changing the course
+    # statistics of the user, so the caches of all processes can tell
+    # stale entries
+    course_revision = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0', index=True)
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     followed = db.relationship('Follow',
                                foreign_keys=[Follow.follower_id],
@@ -109,6 +148,7 @@ class User(UserMixin, db.Model):
                                 cascade='all, delete-orphan')
     comments = db.relationship('Comment', backref='author', lazy='dynamic')
     courses = db.relationship('Course', backref='user', lazy='dynamic')
+    course_stats = db.relationship('CourseStat', lazy='dynamic')
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
@@ -238,11 +278,103 @@ class User(UserMixin, db.Model):
         return Post.query.join(Follow, Follow.followed_id == Post.author_id)\
             .filter(Follow.follower_id == self.id)
 
+    def timeline_query(self):
+        """Return the query of the timeline and the keys of its order.
+
+        The posts of the user and of the followed users are copied to the
+        timeline entries of the user when they are written, so reading the
+        timeline is a range scan of the entries, ordered by their copy of
+        the timestamp of the posts. Only the posts of followed users who do
+        not fan out their posts are read from the posts table.
+        """
+        posts = Post.query.join(
+            TimelineEntry, TimelineEntry.post_id == Post.id).filter(
+            TimelineEntry.owner_id == self.id)
+        pulled = [followed_id for followed_id, in db.session.query(
+            Follow.followed_id).join(User, User.id == Follow.followed_id)
+            .filter(Follow.follower_id == self.id,
+                    User.fan_out_posts.is_(False))]
+        if not pulled:
+            return posts, [(TimelineEntry.timestamp, True, 'timestamp'),
+                           (TimelineEntry.post_id, True, 'id')]
+        return posts.union(Post.query.filter(Post.author_id.in_(pulled))), \
+            [(Post.timestamp, True), (Post.id, True)]
+
+    @property
+    def timeline(self):
+        """The posts of the user and of the followed users, newest first."""
+        query, keys = self.timeline_query()
+        return query.order_by(*(key[0].desc() for key in keys))
+
+    @staticmethod
+    def add_count(connection, counter, user_id, amount):
+        """Add to a counter of a user with an atomic UPDATE."""
+        if user_id is None:
+            return
+        users = User.__table__
+        column = users.c[counter]
+        connection.execute(users.update().where(users.c.id == user_id)
+                           .values({column: column + amount}))
+
+    @staticmethod
+    def on_post_inserted(mapper, connection, target):
+        User.add_count(connection, 'post_count', target.author_id, 1)
+
+    @staticmethod
+    def on_post_deleted(mapper, connection, target):
+        User.add_count(connection, 'post_count', target.author_id, -1)
+
+    @staticmethod
+    def on_follow_inserted(mapper, connection, target):
+        User.add_count(connection, 'follower_count', target.followed_id, 1)
+        User.add_count(connection, 'followed_count', target.follower_id, 1)
+
+    @staticmethod
+    def on_follow_deleted(mapper, connection, target):
+        User.add_count(connection, 'follower_count', target.followed_id, -1)
+        User.add_count(connection, 'followed_count', target.follower_id, -1)
+
+    @staticmethod
+    def recount():
+        """Recount the counters of the users and posts from their rows.
+
+        Returns the number of rows whose counters had drifted, by counter.
+        """
+        users = User.__table__
+        posts = Post.__table__
+        follows = Follow.__table__
+        comments = Comment.__table__
+        counts = [
+            (users, 'post_count',
+             db.select([db.func.count(posts.c.id)]).where(
+                 posts.c.author_id == users.c.id)),
+            (users, 'follower_count',
+             db.select([db.func.count()]).select_from(follows).where(
+                 follows.c.followed_id == users.c.id)),
+            (users, 'followed_count',
+             db.select([db.func.count()]).select_from(follows).where(
+                 follows.c.follower_id == users.c.id)),
+            (posts, 'comment_count',
+             db.select([db.func.count(comments.c.id)]).where(
+                 comments.c.post_id == posts.c.id)),
+        ]
+        drifted = {}
+        for table, counter, count in counts:
+            count = count.as_scalar()
+            column = table.c[counter]
+            result = db.session.execute(
+                table.update().where(db.or_(column.is_(None), column != count))
+                .values({column: count}))
+            drifted['%s.%s' % (table.name, counter)] = result.rowcount
+        return drifted
+
     def __repr__(self):
         return '<User %r>' % self.username
 
 
 db.event.listen(User.email, 'set', User.on_changed_email)
+db.event.listen(Follow, 'after_insert', User.on_follow_inserted)
+db.event.listen(Follow, 'after_delete', User.on_follow_deleted)
 
 
 class AnonymousUser(AnonymousUserMixin):
@@ -263,13 +395,27 @@ def load_user(user_id):
 
 class Post(db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (
+        db.Index('ix_posts_author_timestamp', 'author_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    comment_count = db.Column(db.Integer, nullable=False, default=0,
+                              server_default='0')
     comments = db.relationship('Comment', backref='post', lazy='dynamic')
 
+    # (post id, viewer role) -> (post view, rendered HTML)
+    fragment_cache = LRUCache(4096)
+    FRAGMENT_ROLES = ('author', 'administrator', 'reader')
+
+    @staticmethod
+    def invalidate_fragments(post_id):
+        for role in Post.FRAGMENT_ROLES:
+            Post.fragment_cache.pop((post_id, role))
+
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
         allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
@@ -278,21 +424,133 @@ class Post(db.Model):
         target.body_html = bleach.linkify(bleach.clean(
             markdown(value, output_format='html'),
             tags=allowed_tags, strip=True))
+        if target.id is not None:
+            Post.invalidate_fragments(target.id)
 
 
 db.event.listen(Post.body, 'set', Post.on_changed_body)
+db.event.listen(Post, 'after_insert', User.on_post_inserted)
+db.event.listen(Post, 'after_delete', User.on_post_deleted)
+
+
+class TimelineEntry(db.Model):
+    """A post in the timeline of a user, its author or one of the followers.
+
+    The entries are written when a post is created and when a user follows
+    or unfollows another, so the followed posts of a user never need a join
+    of the follows and the posts. Authors with more followers than
+    ``APP_TIMELINE_FAN_OUT_LIMIT`` stop fanning out their posts, which are
+    then merged into the timelines of their followers when reading.
+    """
+    __tablename__ = 'timeline_entries'
+    __table_args__ = (
+        db.Index('ix_timeline_entries_owner_timestamp', 'owner_id',
+                 'timestamp', 'post_id'),
+    )
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+                         primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'),
+                        primary_key=True, index=True)
+    timestamp = db.Column(db.DateTime)
+
+    @staticmethod
+    def fans_out(connection, user_id):
+        """Return whether the posts of a user are copied to the followers.
+
+        Users who pass the follower limit are marked once and then always
+        have their posts merged in when reading.
+        """
+        users = User.__table__
+        row = connection.execute(
+            db.select([users.c.fan_out_posts, users.c.follower_count])
+            .where(users.c.id == user_id)).first()
+        if row is None or row.fan_out_posts is False:
+            return False
+        limit = current_app.config['APP_TIMELINE_FAN_OUT_LIMIT']
+        if limit is None or (row.follower_count or 0) <= limit:
+            return True
+        connection.execute(users.update().where(users.c.id == user_id)
+                           .values(fan_out_posts=False))
+        return False
+
+    @staticmethod
+    def on_post_inserted(mapper, connection, target):
+        if target.author_id is None:
+            return
+        table = TimelineEntry.__table__
+        follows = Follow.__table__
+        connection.execute(table.insert().values(
+            owner_id=target.author_id, post_id=target.id,
+            timestamp=target.timestamp))
+        if TimelineEntry.fans_out(connection, target.author_id):
+            connection.execute(table.insert().from_select(
+                ['owner_id', 'post_id', 'timestamp'],
+                db.select([follows.c.follower_id, db.literal(target.id),
+                           db.literal(target.timestamp, db.DateTime)])
+                .where(db.and_(follows.c.followed_id == target.author_id,
+                               follows.c.follower_id != target.author_id))))
+
+    @staticmethod
+    def on_post_deleted(mapper, connection, target):
+        table = TimelineEntry.__table__
+        connection.execute(table.delete().where(table.c.post_id == target.id))
+
+    @staticmethod
+    def on_follow_inserted(mapper, connection, target):
+        if target.follower_id == target.followed_id or \
+                not TimelineEntry.fans_out(connection, target.followed_id):
+            return
+        table = TimelineEntry.__table__
+        posts = Post.__table__
+        connection.execute(table.insert().from_select(
+            ['owner_id', 'post_id', 'timestamp'],
+            db.select([db.literal(target.follower_id), posts.c.id,
+                       posts.c.timestamp])
+            .where(posts.c.author_id == target.followed_id)))
+
+    @staticmethod
+    def on_follow_deleted(mapper, connection, target):
+        if target.follower_id == target.followed_id:
+            return
+        table = TimelineEntry.__table__
+        posts = Post.__table__
+        connection.execute(table.delete().where(db.and_(
+            table.c.owner_id == target.follower_id,
+            table.c.post_id.in_(db.select([posts.c.id]).where(
+                posts.c.author_id == target.followed_id)))))
+
+    def __repr__(self):
+        return '<TimelineEntry %r %r>' % (self.owner_id, self.post_id)
+
+
+db.event.listen(Post, 'after_insert', TimelineEntry.on_post_inserted)
+db.event.listen(Post, 'after_delete', TimelineEntry.on_post_deleted)
+db.event.listen(Follow, 'after_insert', TimelineEntry.on_follow_inserted)
+db.event.listen(Follow, 'after_delete', TimelineEntry.on_follow_deleted)
 
 
 class Comment(db.Model):
     __tablename__ = 'comments'
+    __table_args__ = (
+        db.Index('ix_comments_post_timestamp', 'post_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     disabled = db.Column(db.Boolean)
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
 
+    # (comment id, viewer role) -> (comment version, rendered HTML)
+    fragment_cache = LRUCache(8192)
+    FRAGMENT_ROLES = ('moderator', 'reader')
+
+    @staticmethod
+    def invalidate_fragments(comment_id):
+        for role in Comment.FRAGMENT_ROLES:
+            Comment.fragment_cache.pop((comment_id, role))
+
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
         allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
@@ -301,9 +559,35 @@ class Comment(db.Model):
         target.body_html = bleach.linkify(bleach.clean(
             markdown(value, output_format='html'),
             tags=allowed_tags, strip=True))
+        if target.id is not None:
+            Comment.invalidate_fragments(target.id)
+
+    @staticmethod
+    def on_changed_disabled(target, value, oldvalue, initiator):
+        if target.id is not None and value != oldvalue:
+            Comment.invalidate_fragments(target.id)
+
+    @staticmethod
+    def add_comment_count(connection, post_id, amount):
+        if post_id is None:
+            return
+        posts = Post.__table__
+        connection.execute(posts.update().where(posts.c.id == post_id).values(
+            comment_count=posts.c.comment_count + amount))
+
+    @staticmethod
+    def on_comment_inserted(mapper, connection, target):
+        Comment.add_comment_count(connection, target.post_id, 1)
+
+    @staticmethod
+    def on_comment_deleted(mapper, connection, target):
+        Comment.add_comment_count(connection, target.post_id, -1)
 
 
 db.event.listen(Comment.body, 'set', Comment.on_changed_body)
+db.event.listen(Comment.disabled, 'set', Comment.on_changed_disabled)
+db.event.listen(Comment, 'after_insert', Comment.on_comment_inserted)
+db.event.listen(Comment, 'after_delete', Comment.on_comment_deleted)
 
 
 class CourseType:
@@ -345,143 +629,1396 @@ course_type_name = {
     CourseType.PRO_OPTIONAL: '专业选修'
 }
 
+# the transcripts of Nanjing University
+register_profile(UniversityProfile(
+    'nju',
+    columns={'code': 1, 'name': 2, 'type_name': 4, 'credit': 5, 'score': 6},
+    types={'通识': CourseType.GENERAL,
+           '通修': CourseType.PUBLIC_BASIC,
+           '平台': CourseType.PRO_BASIC,
+           '核心': CourseType.PRO_CORE,
+           '选修': CourseType.PRO_OPTIONAL},
+    default=CourseType.PUBLIC_OPTIONAL,
+    prefixes={'选修': dict.fromkeys(('002', '003', '004', '005', '37', '500'),
+                                  CourseType.GENERAL)},
+    zero_credit={'选修': CourseType.READING}))
+
+
+class CourseStatistics:
+    """Weighted score, credit and course count sums per course type.
+
+    The sums are accumulated in a single pass and every GPA or credit
+    figure is derived from them, so callers never walk the courses twice.
+    """
+
+    def __init__(self):
+        self.weighted_scores = {}
+        self.credits = {}
+        self.counts = {}
+
+    def add(self, type_id, weighted_score, credit, count=1):
+        self.weighted_scores[type_id] = \
+            self.weighted_scores.get(type_id, 0.0) + weighted_score
+        self.credits[type_id] = self.credits.get(type_id, 0) + credit
+        self.counts[type_id] = self.counts.get(type_id, 0) + count
+
+    def add_statistics(self, other, sign=1):
+        for type_id in other.counts:
+            self.add(type_id, sign * other.weighted_scores[type_id],
+                     sign * other.credits[type_id],
+                     sign * other.counts[type_id])
+
+    def copy(self):
+        stats = CourseStatistics()
+        stats.add_statistics(self)
+        return stats
+
+    def __add__(self, other):
+        stats = self.copy()
+        stats.add_statistics(other)
+        return stats
+
+    def __sub__(self, other):
+        stats = self.copy()
+        stats.add_statistics(other, sign=-1)
+        return stats
+
+    def add_course(self, course):
+        credit = course.credit or 0
+        self.add(course.type_id, (course.score or 0.0) * credit, credit)
+
+    @staticmethod
+    def from_courses(courses):
+        stats = CourseStatistics()
+        for course in courses:
+            stats.add_course(course)
+        return stats
+
+    @staticmethod
+    def from_stats(course_stats):
+        stats = CourseStatistics()
+        for course_stat in course_stats:
+            stats.add(course_stat.type_id, course_stat.weighted_score,
+                      course_stat.credit, course_stat.course_count)
+        return stats
+
+    @staticmethod
+    def from_query(query):
+        """Aggregate the courses selected by a query inside the database."""
+        rows = query.with_entities(
+            Course.type_id,
+            db.func.sum(Course.score * Course.credit),
+            db.func.sum(Course.credit),
+            db.func.count(Course.id)).group_by(Course.type_id)
+        stats = CourseStatistics()
+        for type_id, weighted_score, credit, count in rows:
+            stats.add(type_id, weighted_score or 0.0, credit or 0, count)
+        return stats
+
+    @staticmethod
+    def _sum(sums, types):
+        if types is None:
+            return sum(sums.values())
+        return sum(sums.get(type_id, 0) for type_id in types)
+
+    def weighted_score(self, types=None):
+        return self._sum(self.weighted_scores, types)
+
+    def credit(self, types=None):
+        return self._sum(self.credits, types)
+
+    def count(self, types=None):
+        return self._sum(self.counts, types)
+
+    def average_weighted_score_on_credit(self, types=None):
+        sum_credit = self.credit(types)
+        if sum_credit == 0:
+            return 0
+        return self.weighted_score(types) / sum_credit
+
+    def required_score(self, gpa, credit, types=None):
+        """Return the average score ``credit`` more credits need for ``gpa``.
+
+        Only the credits of ``types`` count towards the GPA. Returns
+        ``None`` when there are no such credits to solve for.
+        """
+        if credit <= 0:
+            return None
+        return (gpa * 20 * (self.credit(types) + credit) -
+                self.weighted_score(types)) / credit
+
+    def comprehensive_gpa(self):
+        return self.average_weighted_score_on_credit() / 20
+
+    def academic_gpa(self):
+        return self.average_weighted_score_on_credit(
+            CourseType.academic_type()) / 20
+
+    def postgraduate_recommandation_gpa(self):
+        return self.average_weighted_score_on_credit(
+            CourseType.postgraduate_recommandation_type()) / 20
+
+    def reading_count(self):
+        return self.count((CourseType.READING,))
+
+    def have_fullfilled_reading_requirement(self):
+        return self.reading_count() >= 6
+
+    def reading_credit(self):
+        if self.have_fullfilled_reading_requirement():
+            return 2
+        return 0
+
+    def total_credit(self):
+        return self.credit() + self.reading_credit()
+
+    def general_course_credit(self):
+        return self.credit((CourseType.GENERAL,)) + self.reading_credit()
+
+    def public_basic_credit(self):
+        return self.credit((CourseType.PUBLIC_BASIC,
+                            CourseType.PUBLIC_BASIC_MATHS_PHYSICS))
+
+    def public_optional_credit(self):
+        return self.credit((CourseType.PUBLIC_OPTIONAL,))
+
+    def pro_basic_credit(self):
+        return self.credit((CourseType.PRO_BASIC,))
+
+    def pro_core_credit(self):
+        return self.credit((CourseType.PRO_CORE,))
+
+    def pro_optional_credit(self):
+        return self.credit((CourseType.PRO_OPTIONAL,))
+
+    def summary(self):
+        return {
+            '综合GPA': '%.3f' % self.comprehensive_gpa(),
+            '专业GPA': '%.3f' % self.academic_gpa(),
+            '保研GPA': '%.3f' % self.postgraduate_recommandation_gpa(),
+            '已完成经典阅读': '%d' % self.reading_count(),
+            '14通识学分': str(self.general_course_credit()),
+            '通修学分': str(self.public_basic_credit()),
+            '公选学分': str(self.public_optional_credit()),
+            '专业平台学分': str(self.pro_basic_credit()),
+            '专业核心学分': str(self.pro_core_credit()),
+            '专业选修学分': str(self.pro_optional_credit()),
+            '总学分': str(self.total_credit())
+        }
+
+    def to_json(self):
+        return {
+            'comprehensive_gpa': self.comprehensive_gpa(),
+            'academic_gpa': self.academic_gpa(),
+            'postgraduate_recommandation_gpa':
+                self.postgraduate_recommandation_gpa(),
+            'reading_count': self.reading_count(),
+            'general_credit': self.general_course_credit(),
+            'public_basic_credit': self.public_basic_credit(),
+            'public_optional_credit': self.public_optional_credit(),
+            'pro_basic_credit': self.pro_basic_credit(),
+            'pro_core_credit': self.pro_core_credit(),
+            'pro_optional_credit': self.pro_optional_credit(),
+            'total_credit': self.total_credit()
+        }
+
+
+class CatalogCourse(db.Model):
+    """A course of the university, shared by the courses of all students."""
+    __tablename__ = 'catalog_courses'
+    __table_args__ = (
+        db.Index('ix_catalog_courses_code_name', 'code', 'name',
+                 unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(32), nullable=False)
+    name = db.Column(db.String(128), nullable=False)
+    credit = db.Column(db.Integer)
+    # the type the transcripts give the course, students may override it
+    type_id = db.Column(db.Integer)
+
+    # (code, name) -> id of the committed catalog entries
+    cache = LRUCache(65536)
+
+    @staticmethod
+    def _select(keys):
+        table = CatalogCourse.__table__
+        rows = db.session.execute(
+            db.select([table.c.id, table.c.code, table.c.name])
+            .where(table.c.code.in_(set(code for code, _ in keys))))
+        return {(row.code, row.name): row.id for row in rows
+                if (row.code, row.name) in keys}
+
+    @staticmethod
+    def find(keys):
+        """Return the catalog ids of the ``(code, name)`` keys that exist.
+
+        Cached keys cost nothing and the others one SELECT. Nothing is
+        written, and the ids are cached once the transaction commits.
+        """
+        ids = {}
+        missing = set()
+        for key in keys:
+            catalog_id = CatalogCourse.cache.get(key)
+            if catalog_id is None:
+                missing.add(key)
+            else:
+                ids[key] = catalog_id
+        if missing:
+            found = CatalogCourse._select(missing)
+            db.session().info.setdefault('catalog_ids', {}).update(found)
+            ids.update(found)
+        return ids
+
+    @staticmethod
+    def lookup(courses):
+        """Return the catalog ids of ``(code, name)`` keys.
+
+        ``courses`` maps the keys to course attributes, whose credit and
+        type are used for the entries that have to be created. The keys
+        are found with ``find``, and the new entries cost one executemany
+        INSERT and a second SELECT.
+
+        The INSERT runs in a SAVEPOINT. When another transaction creates
+        some of the keys after the SELECT, the unique index rejects it, and
+        the keys it created are selected before inserting the rest again.
+        """
+        ids = CatalogCourse.find(courses)
+        new = set(courses) - set(ids)
+        if new:
+            found = {}
+            while new:
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(CatalogCourse.__table__.insert(), [
+                            {'code': code, 'name': name,
+                             'credit': courses[(code, name)]['credit'],
+                             'type_id': courses[(code, name)]['type_id']}
+                            for code, name in new])
+                except IntegrityError:
+                    created = CatalogCourse._select(new)
+                    if not created:
+                        raise
+                else:
+                    created = CatalogCourse._select(new)
+                found.update(created)
+                new -= set(created)
+            db.session().info.setdefault('catalog_ids', {}).update(found)
+            ids.update(found)
+        return ids
+
+    @staticmethod
+    def on_commit(session):
+        for key, catalog_id in session.info.pop('catalog_ids', {}).items():
+            CatalogCourse.cache.set(key, catalog_id)
+
+    @staticmethod
+    def on_rollback(session):
+        session.info.pop('catalog_ids', None)
+
+
+db.event.listen(db.session, 'after_commit', CatalogCourse.on_commit)
+db.event.listen(db.session, 'after_rollback', CatalogCourse.on_rollback)
+
 
 class Course(db.Model):
     __tablename__ = 'courses'
+    __table_args__ = (
+        db.Index('ix_courses_fingerprint', 'user_id', 'term', 'catalog_id',
+                 unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(128))
-    type_id = db.Column(db.Integer, index=True)
-    credit = db.Column(db.Integer)
-    score = db.Column(db.Float)
-    term = db.Column(db.Integer, index=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    catalog_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('catalog_courses.id')),
+        active_history=True)
+    # only set when the course is not in the catalog or has been renamed
+    _name = db.Column('name', db.String(128))
+    # old values are needed to keep the course statistics up to date
+    type_id = db.column_property(db.Column(db.Integer, index=True),
+                                 active_history=True)
+    credit = db.column_property(db.Column(db.Integer), active_history=True)
+    score = db.column_property(db.Column(db.Float), active_history=True)
+    term = db.column_property(db.Column(db.Integer, index=True),
+                              active_history=True)
+    user_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('users.id')), active_history=True)
+    catalog = db.relationship('CatalogCourse', lazy='joined')
+
+    @hybrid_property
+    def name(self):
+        if self._name is None and self.catalog is not None:
+            return self.catalog.name
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        if self.catalog is not None and name == self.catalog.name:
+            name = None
+        self._name = name
+
+    @name.expression
+    def name(cls):
+        return db.func.coalesce(cls._name, db.select([CatalogCourse.name])
+                                .where(CatalogCourse.id == cls.catalog_id)
+                                .as_scalar())
+
+    @hybrid_property
+    def code(self):
+        if self.catalog is None:
+            return None
+        return self.catalog.code
+
+    @code.expression
+    def code(cls):
+        return db.select([CatalogCourse.code]) \
+            .where(CatalogCourse.id == cls.catalog_id).as_scalar()
+
+    @staticmethod
+    def statistics(courses):
+        if isinstance(courses, CourseStatistics):
+            return courses
+        return CourseStatistics.from_courses(courses)
 
     @staticmethod
     def average_weighted_score_on_credit(courses):
-        sum_score = 0.0
-        sum_credit = 0
-        for course in courses:
-            sum_score += course.score * course.credit
-            sum_credit += course.credit
-        if sum_credit == 0:
-            return 0
-        return sum_score / sum_credit
+        return Course.statistics(courses).average_weighted_score_on_credit()
 
     @staticmethod
     def comprehensive_gpa(courses):
-        return Course.average_weighted_score_on_credit(courses) / 20
+        return Course.statistics(courses).comprehensive_gpa()
 
     @staticmethod
     def academic_gpa(courses):
-        academic_courses = [course for course in courses
-                            if course.type_id in CourseType.academic_type()]
-        return Course.average_weighted_score_on_credit(academic_courses) / 20
+        return Course.statistics(courses).academic_gpa()
 
     @staticmethod
     def postgraduate_recommandation_gpa(courses):
-        pgr_courses = [course for course in courses
-                       if course.type_id in CourseType.postgraduate_recommandation_type()]
-        return Course.average_weighted_score_on_credit(pgr_courses) / 20
+        return Course.statistics(courses).postgraduate_recommandation_gpa()
 
     @staticmethod
     def reading_count(courses):
-        reading_courses = [course for course in courses
-                           if course.type_id == CourseType.READING]
-        return len(reading_courses)
+        return Course.statistics(courses).reading_count()
 
     @staticmethod
     def have_fullfilled_reading_requirement(courses):
-        return Course.reading_count(courses) >= 6
+        return Course.statistics(courses).have_fullfilled_reading_requirement()
 
     @staticmethod
     def reading_credit(courses):
-        if Course.have_fullfilled_reading_requirement(courses):
-            return 2
-        return 0
+        return Course.statistics(courses).reading_credit()
 
     @staticmethod
     def total_credit(courses):
-        return sum([course.credit for course in courses]) + \
-            Course.reading_credit(courses)
+        return Course.statistics(courses).total_credit()
 
     @staticmethod
     def general_course_credit(courses):
-        return sum([course.credit for course in courses
-                    if course.type_id == CourseType.GENERAL]) +\
-            Course.reading_credit(courses)
+        return Course.statistics(courses).general_course_credit()
 
     @staticmethod
     def public_basic_credit(courses):
-        return sum([course.credit for course in courses
-                    if course.type_id in (CourseType.PUBLIC_BASIC,
-                                          CourseType.PUBLIC_BASIC_MATHS_PHYSICS)])
+        return Course.statistics(courses).public_basic_credit()
 
     @staticmethod
     def public_optional_credit(courses):
-        return sum([course.credit for course in courses
-                    if course.type_id == CourseType.PUBLIC_OPTIONAL])
+        return Course.statistics(courses).public_optional_credit()
 
     @staticmethod
     def pro_basic_credit(courses):
-        return sum([course.credit for course in courses
-                    if course.type_id == CourseType.PRO_BASIC])
+        return Course.statistics(courses).pro_basic_credit()
 
     @staticmethod
     def pro_core_credit(courses):
-        return sum([course.credit for course in courses
-                    if course.type_id == CourseType.PRO_CORE])
+        return Course.statistics(courses).pro_core_credit()
 
     @staticmethod
     def pro_optional_credit(courses):
-        return sum([course.credit for course in courses
-                    if course.type_id == CourseType.PRO_OPTIONAL])
-
-    @staticmethod
-    def guess_type_id(data):
-        course_id = data['course_id']
-        type_name = data['type_name']
-        if type_name == '通识':
-            return CourseType.GENERAL
-        if type_name == '通修':
-            return CourseType.PUBLIC_BASIC
-        if type_name == '平台':
-            return CourseType.PRO_BASIC
-        if type_name == '核心':
-            return CourseType.PRO_CORE
-        if type_name == '选修':
-            if data['credit'] == 0:
-                return CourseType.READING
-            if course_id.startswith(('002', '003', '004', '005', '37', '500')):
-                return CourseType.GENERAL
-            return CourseType.PRO_OPTIONAL
-        return CourseType.PUBLIC_OPTIONAL
-
-    @staticmethod
-    def fetch_course(tds):
-        data = {
-            'course_id': tds[1].get_text().strip(),
-            'course_name': tds[2].get_text().strip(),
-            'type_name': tds[4].get_text().strip()
+        return Course.statistics(courses).pro_optional_credit()
+
+    @staticmethod
+    def guess_type_id(data, profile=None):
+        return (profile or get_profile()).classify(
+            data['type_name'], data['course_id'], data['credit'])
+
+    @staticmethod
+    def parse_course(cells, profile=None):
+        return (profile or get_profile()).parse_row(cells)
+
+    @staticmethod
+    def fetch_course(cells):
+        return Course.build_courses([Course.parse_course(cells)])[0]
+
+    @staticmethod
+    def build_courses(mappings):
+        """Build courses from parsed transcript rows.
+
+        The existing catalog entries are found with ``CatalogCourse.find``
+        and loaded with one more query. Nothing is written: the entries
+        missing from the catalog are built without being added to the
+        session, so they are only inserted along with the courses, when a
+        caller adds them to the session.
+        """
+        keys = {(mapping['code'], mapping['name']): mapping
+                for mapping in mappings}
+        catalog_ids = CatalogCourse.find(keys)
+        catalogs = {}
+        if catalog_ids:
+            catalogs = {catalog.id: catalog for catalog in CatalogCourse.query
+                        .filter(CatalogCourse.id.in_(
+                            set(catalog_ids.values())))}
+        for key, mapping in keys.items():
+            if key in catalog_ids:
+                keys[key] = catalogs[catalog_ids[key]]
+            else:
+                keys[key] = CatalogCourse(code=key[0], name=key[1],
+                                          credit=mapping['credit'],
+                                          type_id=mapping['type_id'])
+        return [Course(catalog=keys[(mapping['code'], mapping['name'])],
+                       credit=mapping['credit'], score=mapping['score'],
+                       type_id=mapping['type_id'])
+                for mapping in mappings]
+
+    @staticmethod
+    def detect_encoding(head):
+        """Guess the encoding of a transcript from its first bytes.
+
+        Byte order marks win over ``charset`` declarations, and UTF-8 is
+        assumed when neither is present.
+        """
+        for bom, encoding in ((codecs.BOM_UTF8, 'utf-8'),
+                              (codecs.BOM_UTF16_LE, 'utf-16-le'),
+                              (codecs.BOM_UTF16_BE, 'utf-16-be')):
+            if head.startswith(bom):
+                return encoding
+        match = re.search(br'charset\s*=\s*["\']?([\w.:-]+)', head, re.I)
+        if match:
+            encoding = match.group(1).decode('ascii')
+            try:
+                codecs.lookup(encoding)
+                return encoding
+            except LookupError:
+                pass
+        return 'utf-8'
+
+    @staticmethod
+    def is_course_row(tr):
+        # matches the 'table table:nth-of-type(2) tr' selector
+        for table in tr.iterancestors('table'):
+            if sum(1 for _ in table.itersiblings('table', preceding=True)) \
+                    == 1 and next(table.iterancestors('table'), None) \
+                    is not None:
+                return True
+        return False
+
+    @staticmethod
+    def iter_transcript_rows(source, chunk_size=64 * 1024):
+        """Yield the cell texts of every course row of a transcript.
+
+        ``source`` is the markup or a binary file object. The file is fed
+        to the parser chunk by chunk and every row is freed once it has
+        been read, so memory use does not grow with the transcript. Markup
+        given as ``str`` is already decoded, so its charset declaration is
+        ignored.
+        """
+        encoding = None
+        if isinstance(source, str):
+            source = source.encode('utf-8')
+            encoding = 'utf-8'
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+        # the charset declaration should be within the first 1024 bytes
+        chunk = source.read(max(chunk_size, 1024))
+        parser = etree.HTMLPullParser(
+            events=('end',), tag='tr',
+            encoding=encoding or Course.detect_encoding(chunk))
+        header = True
+        while True:
+            if chunk:
+                parser.feed(chunk)
+            else:
+                parser.close()
+            for _, tr in parser.read_events():
+                if Course.is_course_row(tr):
+                    if header:
+                        header = False
+                    else:
+                        yield [''.join(td.itertext()).strip()
+                               for td in tr.iter('td')]
+                tr.clear()
+                previous = tr.getprevious()
+                while previous is not None and previous.tag == 'tr':
+                    tr.getparent().remove(previous)
+                    previous = tr.getprevious()
+            if not chunk:
+                break
+            chunk = source.read(chunk_size)
+
+    @staticmethod
+    def iter_courses(source, batch_size=500):
+        rows = Course.iter_transcript_rows(source)
+        while True:
+            batch = [Course.parse_course(cells)
+                     for cells in islice(rows, batch_size)]
+            if not batch:
+                break
+            for course in Course.build_courses(batch):
+                yield course
+
+    @staticmethod
+    def fetch_courses(source):
+        return list(Course.iter_courses(source))
+
+    @staticmethod
+    def _upsert_batch(user_id, term, batch):
+        """Insert the new courses of a batch and update the changed ones.
+
+        The catalog entries of the batch are looked up or created first,
+        then the existing courses are found by their fingerprint with one
+        SELECT. Re-imports only refresh the credit and the score, so course
+        types corrected by the user are kept. The score bins of the batch
+        are updated before returning, the course statistics are left to the
+        caller.
+        """
+        table = Course.__table__
+        catalog_ids = CatalogCourse.lookup(batch)
+        existing = {
+            row.catalog_id: row for row in db.session.execute(
+                db.select([table.c.id, table.c.catalog_id, table.c.type_id,
+                           table.c.credit, table.c.score])
+                .where(db.and_(table.c.user_id == user_id,
+                               table.c.term == term,
+                               table.c.catalog_id.in_(
+                                   set(catalog_ids.values())))))}
+        inserts = []
+        updates = []
+        deltas = {}
+        score_deltas = {}
+        for key, mapping in batch.items():
+            old = existing.get(catalog_ids[key])
+            if old is None:
+                inserts.append({'user_id': user_id, 'term': term,
+                                'catalog_id': catalog_ids[key],
+                                'type_id': mapping['type_id'],
+                                'credit': mapping['credit'],
+                                'score': mapping['score']})
+                deltas = CourseStat.merge(deltas, CourseStat.course_delta(
+                    user_id, term, mapping['type_id'], mapping['credit'],
+                    mapping['score']))
+                score_deltas = CourseScoreBin.merge(
+                    score_deltas, CourseScoreBin.course_delta(
+                        catalog_ids[key], mapping['score']))
+            elif (old.credit, old.score) != \
+                    (mapping['credit'], mapping['score']):
+                updates.append({'course_id': old.id,
+                                'credit': mapping['credit'],
+                                'score': mapping['score']})
+                deltas = CourseStat.merge(
+                    deltas,
+                    CourseStat.course_delta(user_id, term, old.type_id,
+                                            old.credit, old.score, sign=-1),
+                    CourseStat.course_delta(user_id, term, old.type_id,
+                                            mapping['credit'],
+                                            mapping['score']))
+                score_deltas = CourseScoreBin.merge(
+                    score_deltas,
+                    CourseScoreBin.course_delta(old.catalog_id, old.score,
+                                                sign=-1),
+                    CourseScoreBin.course_delta(old.catalog_id,
+                                                mapping['score']))
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+        if updates:
+            db.session.execute(
+                table.update().where(
+                    table.c.id == db.bindparam('course_id')),
+                updates)
+        CourseScoreBin.apply(db.session.connection(), score_deltas)
+        return len(inserts), len(updates), deltas
+
+    @staticmethod
+    def bulk_import(user_id, term, rows, batch_size=500, progress=None,
+                    profile=None):
+        """Upsert transcript rows for a user in batches.
+
+        Courses are matched on their ``(user_id, term, catalog_id)``
+        fingerprint, so importing the same transcript again only updates
+        changed scores. Each batch costs one SELECT and at most one
+        executemany INSERT and UPDATE for the courses and for their score
+        bins, and the course statistics are updated once at the end, all in
+        the current transaction. Rows with
+        missing cells count as failed; rows without a course name, repeated
+        rows and unchanged courses as skipped. ``progress`` is called with
+        the ``ImportResult`` so far after every batch. The rows are read
+        and classified by ``profile``, the configured university profile by
+        default.
+        """
+        profile = profile or get_profile()
+        inserted = updated = skipped = failed = 0
+        deltas = {}
+        batch = {}
+        seen = set()
+
+        def flush():
+            nonlocal inserted, updated, skipped, deltas
+            batch_inserted, batch_updated, batch_deltas = \
+                Course._upsert_batch(user_id, term, batch)
+            inserted += batch_inserted
+            updated += batch_updated
+            skipped += len(batch) - batch_inserted - batch_updated
+            deltas = CourseStat.merge(deltas, batch_deltas)
+            batch.clear()
+
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                break
+            for mapping in profile.parse_rows(chunk):
+                if mapping is None:
+                    failed += 1
+                    continue
+                key = (mapping['code'], mapping['name'])
+                if not mapping['name'] or key in seen:
+                    skipped += 1
+                    continue
+                seen.add(key)
+                batch[key] = mapping
+            if len(batch) >= batch_size:
+                flush()
+                if progress is not None:
+                    progress(ImportResult(inserted, updated, skipped,
+                                          failed))
+        if batch:
+            flush()
+        CourseStat.apply(db.session.connection(), deltas)
+        CourseStat.mark_changed(db.session(), [user_id])
+        return ImportResult(inserted, updated, skipped, failed)
+
+    @staticmethod
+    def bulk_delete(user_ids, term=None, type_id=None):
+        """Delete the courses of users with a single DELETE statement.
+
+        The deletion can be narrowed to a term or a course type. The
+        matching course statistics and score bins are updated in the same
+        transaction, and the number of deleted courses is returned.
+        """
+        courses = Course.__table__
+        stats = CourseStat.__table__
+        user_ids = list(user_ids)
+        course_filter = [courses.c.user_id.in_(user_ids)]
+        stat_filter = [stats.c.user_id.in_(user_ids)]
+        if term is not None:
+            course_filter.append(courses.c.term == term)
+            stat_filter.append(stats.c.term == term)
+        if type_id is not None:
+            course_filter.append(courses.c.type_id == type_id)
+            stat_filter.append(stats.c.type_id == type_id)
+        CourseScoreBin.apply(db.session.connection(), {
+            (catalog_id, bin): (-count, -score_sum)
+            for catalog_id, bin, count, score_sum in db.session.execute(
+                CourseScoreBin.grouped_scores(db.and_(*course_filter)))})
+        result = db.session.execute(
+            courses.delete().where(db.and_(*course_filter)))
+        db.session.execute(stats.delete().where(db.and_(*stat_filter)))
+        CourseStat.mark_changed(db.session(), user_ids)
+        return result.rowcount
+
+
+# serves the course list of a user, ordered by term desc, type_id and id
+db.Index('ix_courses_user_term_type', Course.user_id, Course.term.desc(),
+         Course.type_id, Course.id)
+
+ImportResult = namedtuple('ImportResult',
+                          ['inserted', 'updated', 'skipped', 'failed'])
+
+
+class CourseRevision(db.Model):
+    """Counter of the transactions that changed course statistics.
+
+    The single row is incremented once per transaction, which holds its
+    lock until the commit, so the revisions are committed in order.
+    """
+    __tablename__ = 'course_revisions'
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def next(connection):
+        table = CourseRevision.__table__
+        result = connection.execute(table.update().where(
+            table.c.id == 1).values(value=table.c.value + 1))
+        if not result.rowcount:
+            connection.execute(table.insert().values(id=1, value=1))
+        return connection.execute(db.select([table.c.value]).where(
+            table.c.id == 1)).scalar()
+
+    @staticmethod
+    def current():
+        return db.session.query(CourseRevision.value).filter_by(
+            id=1).scalar() or 0
+
+
+class CourseStat(db.Model):
+    __tablename__ = 'course_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+                        primary_key=True)
+    term = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    type_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    weighted_score = db.Column(db.Float, default=0.0)
+    credit = db.Column(db.Integer, default=0)
+    course_count = db.Column(db.Integer, default=0)
+
+    @staticmethod
+    def apply(connection, deltas):
+        """Add ``(weighted_score, credit, count)`` deltas to the stats.
+
+        ``deltas`` maps ``(user_id, term, type_id)`` keys to the amounts to
+        add, so callers can merge the changes of many courses into a few
+        statements.
+        """
+        table = CourseStat.__table__
+        for key, (weighted_score, credit, count) in deltas.items():
+            user_id, term, type_id = key
+            if user_id is None or term is None or type_id is None \
+                    or not any((weighted_score, credit, count)):
+                continue
+            where = db.and_(table.c.user_id == user_id,
+                            table.c.term == term,
+                            table.c.type_id == type_id)
+            result = connection.execute(table.update().where(where).values(
+                weighted_score=table.c.weighted_score + weighted_score,
+                credit=table.c.credit + credit,
+                course_count=table.c.course_count + count))
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(
+                    user_id=user_id, term=term, type_id=type_id,
+                    weighted_score=weighted_score, credit=credit,
+                    course_count=count))
+            elif count < 0:
+                connection.execute(table.delete().where(
+                    db.and_(where, table.c.course_count <= 0)))
+
+    @staticmethod
+    def rebuild(user_id=None):
+        """Recompute the stats from the courses table."""
+        table = CourseStat.__table__
+        courses = Course.__table__
+        delete = table.delete()
+        select = db.select([
+            courses.c.user_id, courses.c.term, courses.c.type_id,
+            db.func.coalesce(
+                db.func.sum(courses.c.score * courses.c.credit), 0.0),
+            db.func.coalesce(db.func.sum(courses.c.credit), 0),
+            db.func.count(courses.c.id)
+        ]).where(db.and_(courses.c.user_id.isnot(None),
+                         courses.c.term.isnot(None),
+                         courses.c.type_id.isnot(None)))
+        if user_id is not None:
+            delete = delete.where(table.c.user_id == user_id)
+            select = select.where(courses.c.user_id == user_id)
+        select = select.group_by(courses.c.user_id, courses.c.term,
+                                 courses.c.type_id)
+        db.session.execute(delete)
+        db.session.execute(table.insert().from_select(
+            ['user_id', 'term', 'type_id', 'weighted_score', 'credit',
+             'course_count'], select))
+        if user_id is not None:
+            CourseStat.mark_changed(db.session(), [user_id])
+        else:
+            users = User.__table__
+            db.session.execute(users.update().values(
+                course_revision=CourseStat.revision(db.session())))
+
+    @staticmethod
+    def course_delta(user_id, term, type_id, credit, score, sign=1):
+        credit = credit or 0
+        return {(user_id, term, type_id):
+                (sign * (score or 0.0) * credit, sign * credit, sign)}
+
+    @staticmethod
+    def merge(*deltas):
+        merged = {}
+        for delta in deltas:
+            for key, values in delta.items():
+                old = merged.get(key, (0.0, 0, 0))
+                merged[key] = tuple(a + b for a, b in zip(old, values))
+        return merged
+
+    @staticmethod
+    def revision(session):
+        """Return the CourseRevision of the current transaction."""
+        revision = session.info.get('course_revision')
+        if revision is None:
+            revision = session.info['course_revision'] = \
+                CourseRevision.next(session.connection())
+        return revision
+
+    @staticmethod
+    def mark_changed(session, user_ids):
+        """Record that the course statistics of users changed.
+
+        The users are stamped with the revision of the transaction, and
+        sent with ``courses_changed`` after the commit.
+        """
+        changed = session.info.setdefault('changed_course_users', set())
+        user_ids = set(user_ids) - changed - {None}
+        if user_ids:
+            users = User.__table__
+            session.connection().execute(
+                users.update().where(users.c.id.in_(user_ids)).values(
+                    course_revision=CourseStat.revision(session)))
+            changed.update(user_ids)
+
+    @staticmethod
+    def on_commit(session):
+        session.info.pop('course_revision', None)
+        user_ids = session.info.pop('changed_course_users', None)
+        if user_ids:
+            courses_changed.send(session, user_ids=user_ids)
+
+    @staticmethod
+    def on_rollback(session):
+        session.info.pop('course_revision', None)
+        session.info.pop('changed_course_users', None)
+
+    @staticmethod
+    def on_course_inserted(mapper, connection, target):
+        CourseStat.mark_changed(db.object_session(target), [target.user_id])
+        CourseStat.apply(connection, CourseStat.course_delta(
+            target.user_id, target.term, target.type_id,
+            target.credit, target.score))
+
+    @staticmethod
+    def on_course_updated(mapper, connection, target):
+        state = db.inspect(target)
+        old = {}
+        for name in ('user_id', 'term', 'type_id', 'credit', 'score'):
+            history = state.attrs[name].history
+            old[name] = history.deleted[0] if history.deleted \
+                else getattr(target, name)
+        CourseStat.mark_changed(db.object_session(target),
+                                [old['user_id'], target.user_id])
+        CourseStat.apply(connection, CourseStat.merge(
+            CourseStat.course_delta(old['user_id'], old['term'],
+                                    old['type_id'], old['credit'],
+                                    old['score'], sign=-1),
+            CourseStat.course_delta(target.user_id, target.term,
+                                    target.type_id, target.credit,
+                                    target.score)))
+
+    @staticmethod
+    def on_course_deleted(mapper, connection, target):
+        CourseStat.mark_changed(db.object_session(target), [target.user_id])
+        CourseStat.apply(connection, CourseStat.course_delta(
+            target.user_id, target.term, target.type_id,
+            target.credit, target.score, sign=-1))
+
+    def __repr__(self):
+        return '<CourseStat %r %r %r>' % (self.user_id, self.term,
+                                          self.type_id)
+
+
+db.event.listen(Course, 'after_insert', CourseStat.on_course_inserted)
+db.event.listen(Course, 'after_update', CourseStat.on_course_updated)
+db.event.listen(Course, 'after_delete', CourseStat.on_course_deleted)
+db.event.listen(db.session, 'after_commit', CourseStat.on_commit)
+db.event.listen(db.session, 'after_rollback', CourseStat.on_rollback)
+
+
+class ScoreDistribution:
+    """The scores of a course, counted in one point wide bins from 0 to 100.
+
+    Quantiles and percentiles are interpolated within a bin, so they are
+    accurate to a point.
+    """
+    BINS = 101
+
+    def __init__(self, counts=None, score_sum=0.0):
+        self.counts = counts or [0] * self.BINS
+        self.score_sum = score_sum
+
+    @staticmethod
+    def bin_of(score):
+        return min(max(int(score), 0), ScoreDistribution.BINS - 1)
+
+    def count(self):
+        return sum(self.counts)
+
+    def mean(self):
+        count = self.count()
+        if count == 0:
+            return None
+        return self.score_sum / count
+
+    def quantile(self, q):
+        """Return the score below which a ``q`` share of the scores lie."""
+        count = self.count()
+        if count == 0:
+            return None
+        target = q * count
+        cumulative = 0
+        for bin, bin_count in enumerate(self.counts):
+            if bin_count and cumulative + bin_count >= target:
+                return min(bin + (target - cumulative) / bin_count,
+                           self.BINS - 1)
+            cumulative += bin_count
+        return self.BINS - 1
+
+    def percentile(self, score):
+        """Return the share of the scores not higher than ``score``."""
+        count = self.count()
+        if count == 0:
+            return None
+        return 100.0 * sum(self.counts[:self.bin_of(score) + 1]) / count
+
+    def histogram(self, width=10):
+        """Merge the bins into bins ``width`` points wide.
+
+        The last bin also holds the full scores.
+        """
+        size = (self.BINS - 1 + width - 1) // width
+        counts = [0] * size
+        for bin, bin_count in enumerate(self.counts):
+            counts[min(bin // width, size - 1)] += bin_count
+        return [{'from': i * width, 'to': min((i + 1) * width, self.BINS - 1),
+                 'count': bin_count} for i, bin_count in enumerate(counts)]
+
+    def to_json(self, width=10, score=None, min_count=0):
+        """Summarize the distribution, locating ``score`` within it.
+
+        Below ``min_count`` scores only the count is given, so the scores
+        of the few students who took a course cannot be read from it.
+        """
+        if self.count() < min_count:
+            result = {'count': self.count(), 'mean': None, 'quantiles': {},
+                      'bins': [], 'suppressed': True}
+            if score is not None:
+                result.update(score=score, percentile=None)
+            return result
+        mean = self.mean()
+        result = {
+            'count': self.count(),
+            'mean': None if mean is None else round(mean, 2),
+            'quantiles': {},
+            'bins': self.histogram(width),
+            'suppressed': False
         }
-        try:
-            data['credit'] = int(tds[5].get_text().strip())
-        except:
-            data['credit'] = 0
-        try:
-            data['score'] = float(tds[6].get_text().strip())
-        except:
-            data['score'] = 0.0
-        course = Course(name=data['course_name'],
-                        credit=data['credit'],
-                        score=data['score'],
-                        type_id=Course.guess_type_id(data))
-        return course
-
-    @staticmethod
-    def fetch_courses(markup):
-        soup = BeautifulSoup(markup, features='lxml')
-        courses = []
-        for tr in soup.select('table table:nth-of-type(2) tr')[1:]:
-            course = Course.fetch_course(tr.find_all('td'))
-            courses.append(course)
-        return courses
+        for q in (0.25, 0.5, 0.75, 0.9):
+            value = self.quantile(q)
+            result['quantiles']['p%d' % (q * 100)] = \
+                None if value is None else round(value, 2)
+        if score is not None:
+            percentile = self.percentile(score)
+            result['score'] = score
+            result['percentile'] = \
+                None if percentile is None else round(percentile, 2)
+        return result
+
+
+class CourseScoreBin(db.Model):
+    """Number and sum of the scores of a catalog course in a score bin.
+
+    The bins are updated with every change of the courses, so the score
+    distribution of a course is read from at most one row per bin, however
+    many students have taken it.
+    """
+    __tablename__ = 'course_score_bins'
+    catalog_id = db.Column(db.Integer, db.ForeignKey('catalog_courses.id'),
+                           primary_key=True, autoincrement=False)
+    bin = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, default=0)
+    score_sum = db.Column(db.Float, default=0.0)
+
+    @staticmethod
+    def course_delta(catalog_id, score, sign=1):
+        if catalog_id is None or score is None:
+            return {}
+        return {(catalog_id, ScoreDistribution.bin_of(score)):
+                (sign, sign * score)}
+
+    @staticmethod
+    def merge(*deltas):
+        merged = {}
+        for delta in deltas:
+            for key, (count, score_sum) in delta.items():
+                old_count, old_score_sum = merged.get(key, (0, 0.0))
+                merged[key] = (old_count + count, old_score_sum + score_sum)
+        return merged
+
+    @staticmethod
+    def _existing(connection, keys):
+        table = CourseScoreBin.__table__
+        return set(
+            (row.catalog_id, row.bin) for row in connection.execute(
+                db.select([table.c.catalog_id, table.c.bin]).where(
+                    table.c.catalog_id.in_(
+                        set(catalog_id for catalog_id, _ in keys))))
+            if (row.catalog_id, row.bin) in keys)
+
+    @staticmethod
+    def apply(connection, deltas):
+        """Add ``(count, score_sum)`` deltas to the bins.
+
+        ``deltas`` maps ``(catalog_id, bin)`` keys to the amounts to add.
+        The existing bins are found with one SELECT and then updated and
+        created with at most one executemany UPDATE and INSERT, so a whole
+        import batch costs a few statements. The INSERT runs in a
+        SAVEPOINT; when another transaction created some of the bins after
+        the SELECT, it is rolled back and the deltas are added to them.
+        """
+        deltas = {key: value for key, value in deltas.items() if any(value)}
+        if not deltas:
+            return
+        table = CourseScoreBin.__table__
+        existing = CourseScoreBin._existing(connection, deltas)
+        updates = []
+        inserts = []
+        for (catalog_id, bin), (count, score_sum) in deltas.items():
+            if (catalog_id, bin) in existing:
+                updates.append({'key_catalog_id': catalog_id, 'key_bin': bin,
+                                'delta_count': count,
+                                'delta_score_sum': score_sum})
+            elif count > 0:
+                inserts.append({'catalog_id': catalog_id, 'bin': bin,
+                                'count': count, 'score_sum': score_sum})
+        if updates:
+            connection.execute(table.update().where(db.and_(
+                table.c.catalog_id == db.bindparam('key_catalog_id'),
+                table.c.bin == db.bindparam('key_bin'))).values(
+                    count=table.c.count + db.bindparam('delta_count'),
+                    score_sum=table.c.score_sum +
+                    db.bindparam('delta_score_sum')),
+                updates)
+        if inserts:
+            try:
+                with connection.begin_nested():
+                    connection.execute(table.insert(), inserts)
+            except IntegrityError:
+                conflicts = {(row['catalog_id'], row['bin']):
+                             (row['count'], row['score_sum'])
+                             for row in inserts}
+                if not CourseScoreBin._existing(connection, conflicts):
+                    raise
+                CourseScoreBin.apply(connection, conflicts)
+        if any(count < 0 for count, _ in deltas.values()):
+            connection.execute(table.delete().where(db.and_(
+                table.c.catalog_id.in_(set(
+                    catalog_id for (catalog_id, _), (count, _) in
+                    deltas.items() if count < 0)),
+                table.c.count <= 0)))
+
+    @staticmethod
+    def bin_expression(score):
+        """Return the SQL expression of ``ScoreDistribution.bin_of``.
+
+        Casting to an integer truncates on SQLite but rounds on other
+        databases, so the cast is corrected down to the floor.
+        """
+        cast = db.cast(score, db.Integer)
+        return db.case([
+            (score < 0, 0),
+            (score >= ScoreDistribution.BINS - 1, ScoreDistribution.BINS - 1)
+        ], else_=cast - db.case([(cast > score, 1)], else_=0))
+
+    @staticmethod
+    def grouped_scores(where):
+        """Select the ``(catalog_id, bin, count, score_sum)`` of courses."""
+        courses = Course.__table__
+        bin = CourseScoreBin.bin_expression(courses.c.score)
+        return db.select([
+            courses.c.catalog_id, bin, db.func.count(courses.c.id),
+            db.func.sum(courses.c.score)
+        ]).where(db.and_(where, courses.c.catalog_id.isnot(None),
+                         courses.c.score.isnot(None))).group_by(
+            courses.c.catalog_id, bin)
+
+    @staticmethod
+    def rebuild():
+        """Recompute the bins from the courses table."""
+        table = CourseScoreBin.__table__
+        db.session.execute(table.delete())
+        db.session.execute(table.insert().from_select(
+            ['catalog_id', 'bin', 'count', 'score_sum'],
+            CourseScoreBin.grouped_scores(db.true())))
+
+    @staticmethod
+    def distribution(catalog_id):
+        distribution = ScoreDistribution()
+        for score_bin in CourseScoreBin.query.filter_by(catalog_id=catalog_id):
+            distribution.counts[score_bin.bin] = score_bin.count
+            distribution.score_sum += score_bin.score_sum
+        return distribution
+
+    @staticmethod
+    def on_course_inserted(mapper, connection, target):
+        CourseScoreBin.apply(connection, CourseScoreBin.course_delta(
+            target.catalog_id, target.score))
+
+    @staticmethod
+    def on_course_updated(mapper, connection, target):
+        state = db.inspect(target)
+        old = {}
+        for name in ('catalog_id', 'score'):
+            history = state.attrs[name].history
+            old[name] = history.deleted[0] if history.deleted \
+                else getattr(target, name)
+        CourseScoreBin.apply(connection, CourseScoreBin.merge(
+            CourseScoreBin.course_delta(old['catalog_id'], old['score'],
+                                        sign=-1),
+            CourseScoreBin.course_delta(target.catalog_id, target.score)))
+
+    @staticmethod
+    def on_course_deleted(mapper, connection, target):
+        CourseScoreBin.apply(connection, CourseScoreBin.course_delta(
+            target.catalog_id, target.score, sign=-1))
+
+    def __repr__(self):
+        return '<CourseScoreBin %r %r>' % (self.catalog_id, self.bin)
+
+
+db.event.listen(Course, 'after_insert', CourseScoreBin.on_course_inserted)
+db.event.listen(Course, 'after_update', CourseScoreBin.on_course_updated)
+db.event.listen(Course, 'after_delete', CourseScoreBin.on_course_deleted)
+
+
+class TermPrefixSums:
+    """Cumulative course statistics of a user, term by term.
+
+    The statistics of any range of terms are the difference of two prefix
+    entries, so switching term ranges never touches the database again.
+    The terms run from ``first_term`` to ``last_term``, which cover every
+    term the user has courses in and at least terms 1 to ``TERMS``.
+    """
+    TERMS = 8
+
+    cache = LRUCache(1024)
+
+    def __init__(self, course_stats, revision=None):
+        self.revision = revision
+        per_term = {}
+        for course_stat in course_stats:
+            per_term.setdefault(course_stat.term, CourseStatistics()).add(
+                course_stat.type_id, course_stat.weighted_score,
+                course_stat.credit, course_stat.course_count)
+        self.first_term = min([1] + list(per_term))
+        self.last_term = max([self.TERMS] + list(per_term))
+        # prefix[i] sums the terms before first_term + i
+        self.prefix = [CourseStatistics()]
+        for term in range(self.first_term, self.last_term + 1):
+            self.prefix.append(
+                self.prefix[-1] + per_term.get(term, CourseStatistics()))
+        self._trajectory = None
+
+    @staticmethod
+    def for_user(user_id):
+        """Return the prefix sums of a user.
+
+        Cached entries are checked against the course revision of the
+        user, so changes made by other processes are seen at the cost of a
+        primary key lookup. Statistics changed by the current transaction
+        are not cached until it commits.
+        """
+        revision = db.session.query(User.course_revision).filter_by(
+            id=user_id).scalar()
+        prefix_sums = TermPrefixSums.cache.get(user_id)
+        if prefix_sums is None or prefix_sums.revision != revision:
+            prefix_sums = TermPrefixSums(
+                CourseStat.query.filter_by(user_id=user_id), revision)
+            if user_id not in db.session().info.get(
+                    'changed_course_users', ()):
+                TermPrefixSums.cache.set(user_id, prefix_sums)
+        return prefix_sums
+
+    @staticmethod
+    def on_courses_changed(sender, user_ids):
+        for user_id in user_ids:
+            TermPrefixSums.cache.pop(user_id)
+
+    def range(self, term_from, term_to):
+        term_from = max(term_from, self.first_term)
+        term_to = min(term_to, self.last_term)
+        if term_from > term_to:
+            return CourseStatistics()
+        return self.prefix[term_to - self.first_term + 1] - \
+            self.prefix[term_from - self.first_term]
+
+    def total(self):
+        """Return the statistics of all terms."""
+        return self.prefix[-1]
+
+    def terms(self):
+        return range(self.first_term, self.last_term + 1)
+
+    def trajectory(self):
+        """Return the statistics of every term and of the terms up to it.
+
+        The result is kept with the prefix sums, so it is built once per
+        change of the courses of the user.
+        """
+        if self._trajectory is None:
+            self._trajectory = [
+                {'term': term,
+                 'term_statistics': self.range(term, term).to_json(),
+                 'cumulative_statistics':
+                     self.range(self.first_term, term).to_json()}
+                for term in self.terms()]
+        return self._trajectory
+
+    def all_ranges(self):
+        return {(term_from, term_to): self.range(term_from, term_to)
+                for term_from in self.terms()
+                for term_to in self.terms() if term_from <= term_to}
+
+
+courses_changed.connect(TermPrefixSums.on_courses_changed)
+
+
+class GPARanking:
+    """Sorted GPA index of every user who has credits.
+
+    The index is loaded with one grouped query and then kept up to date
+    user by user, so rank and percentile lookups are binary searches.
+    Users are reloaded when their course revision is above the last
+    CourseRevision seen, whichever process changed their courses.
+    """
+    METRICS = {
+        'comprehensive': CourseStatistics.comprehensive_gpa,
+        'academic': CourseStatistics.academic_gpa,
+        'postgraduate_recommandation':
+            CourseStatistics.postgraduate_recommandation_gpa
+    }
+    # the course types that count towards each metric
+    METRIC_TYPES = {
+        'comprehensive': None,
+        'academic': CourseType.academic_type(),
+        'postgraduate_recommandation':
+            CourseType.postgraduate_recommandation_type()
+    }
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self.version = None
+        # users changed by a transaction that was not committed yet
+        self.stale = set()
+        self.gpas = {}
+        self.sorted_gpas = {metric: [] for metric in self.METRICS}
+
+    @staticmethod
+    def compute(stats):
+        """Return the GPA of every metric for statistics with credits.
+
+        Metrics without credits of their course types are ``None``, and so
+        is the result when there are no credits at all.
+        """
+        if stats.credit() == 0:
+            return None
+        return {metric: gpa(stats)
+                if stats.credit(GPARanking.METRIC_TYPES[metric]) else None
+                for metric, gpa in GPARanking.METRICS.items()}
+
+    def _insert(self, user_id, gpas):
+        self.gpas[user_id] = gpas
+        for metric, gpa in gpas.items():
+            if gpa is not None:
+                insort(self.sorted_gpas[metric], gpa)
+
+    def _remove(self, user_id):
+        gpas = self.gpas.pop(user_id, None)
+        if gpas is None:
+            return
+        for metric, gpa in gpas.items():
+            if gpa is not None:
+                sorted_gpas = self.sorted_gpas[metric]
+                del sorted_gpas[bisect_left(sorted_gpas, gpa)]
+
+    @staticmethod
+    def _stats(user_ids=None):
+        query = db.session.query(
+            CourseStat.user_id, CourseStat.type_id,
+            db.func.sum(CourseStat.weighted_score),
+            db.func.sum(CourseStat.credit),
+            db.func.sum(CourseStat.course_count)
+        )
+        if user_ids is not None:
+            query = query.filter(CourseStat.user_id.in_(user_ids))
+        stats = {}
+        for user_id, type_id, weighted_score, credit, count in \
+                query.group_by(CourseStat.user_id, CourseStat.type_id):
+            stats.setdefault(user_id, CourseStatistics()).add(
+                type_id, weighted_score, credit, count)
+        return stats
+
+    def _refresh(self):
+        """Reload the users changed since the last CourseRevision seen.
+
+        Nothing else is read while the revision stays the same. Half the
+        ranked users or more changing reloads the whole index with one
+        grouped query.
+        """
+        version = CourseRevision.current()
+        if version == self.version and not self.stale:
+            return
+        changed = None
+        if self.version is not None:
+            changed = self.stale.union(user_id for user_id, in
+                                       db.session.query(User.id).filter(
+                                           User.course_revision >
+                                           self.version))
+            if 2 * len(changed) >= len(self.gpas):
+                changed = None
+        if changed is None:
+            self.gpas = {}
+            self.sorted_gpas = {metric: [] for metric in self.METRICS}
+            stats = self._stats()
+        else:
+            for user_id in changed:
+                self._remove(user_id)
+            stats = self._stats(changed)
+        for user_id, user_stats in stats.items():
+            gpas = self.compute(user_stats)
+            if gpas is not None:
+                self._insert(user_id, gpas)
+        # the changes of the current transaction may still be rolled back,
+        # and the revisions before its own are all committed
+        info = db.session().info
+        self.stale = set(info.get('changed_course_users', ()))
+        self.version = version
+        if 'course_revision' in info:
+            self.version = info['course_revision'] - 1
+            if not self.stale:
+                # every user was rebuilt
+                self.version = None
+
+    def rank(self, user_id):
+        """Return the rank and percentile of a user for every metric.
+
+        The percentile is the share of ranked users whose GPA is not
+        higher than the user's. ``None`` is returned for users without
+        any credit, and for the metrics they have no credits of.
+        """
+        with self._lock:
+            self._refresh()
+            gpas = self.gpas.get(user_id)
+            if gpas is None:
+                return None
+            result = {}
+            for metric, gpa in gpas.items():
+                if gpa is None:
+                    result[metric] = None
+                    continue
+                sorted_gpas = self.sorted_gpas[metric]
+                total = len(sorted_gpas)
+                not_higher = bisect_right(sorted_gpas, gpa)
+                result[metric] = {
+                    'gpa': round(gpa, 3),
+                    'rank': total - not_higher + 1,
+                    'total': total,
+                    'percentile': round(100.0 * not_higher / total, 2)
+                }
+            return result
+
+
+gpa_ranking = GPARanking()
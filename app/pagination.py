@@ -0,0 +1,142 @@
+from datetime import datetime
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from . import db
+
+DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict):
+        for fmt in DATETIME_FORMATS:
+            try:
+                return datetime.strptime(value['dt'], fmt)
+            except ValueError:
+                pass
+        raise ValueError('invalid datetime %r' % value['dt'])
+    return value
+
+
+class KeysetPagination:
+    """Cursor based pagination over a query.
+
+    ``keys`` is a list of ``(column, descending)`` pairs giving the order of
+    the rows; together they must identify a row, so the last key is usually
+    the primary key. A key can name the attribute of the items holding its
+    value as a third element, when it is not the name of the column. Instead
+    of an OFFSET every page continues from the keys of the last row of the
+    page before, so deep pages cost the same as the first one. The cursors
+    are signed and opaque to the client, and replace any order of the query.
+
+    A ``cursor`` of ``'last'`` shows the last page. ``total`` is optional
+    and only used for display, so callers can pass a cached count.
+
+    The cursors also carry the position of their row, so ``first`` is the
+    position of the first item of the page, counted from 1, without
+    counting the rows before it. It is ``None`` when unknown, as on the
+    last page without a ``total``.
+    """
+
+    def __init__(self, query, keys, per_page, cursor=None, total=None):
+        self.keys = [(key[0], key[1]) for key in keys]
+        self.attributes = [key[2] if len(key) > 2 else key[0].key
+                           for key in keys]
+        self.per_page = per_page
+        self.total = total
+        self.cursor = cursor
+        direction, values, position = self._load_cursor(cursor)
+        backwards = direction != 'next'
+        if values is not None:
+            query = query.filter(self._after(values, backwards))
+        order = [column.asc() if descending == backwards else column.desc()
+                 for column, descending in self.keys]
+        items = query.order_by(None).order_by(*order) \
+            .limit(per_page + 1).all()
+        more = len(items) > per_page
+        items = items[:per_page]
+        if backwards:
+            items.reverse()
+            self.has_prev = more
+            self.has_next = values is not None
+        else:
+            self.has_next = more
+            self.has_prev = values is not None
+        self.items = items
+        if not self.has_prev:
+            self.first = 1
+        elif not backwards:
+            self.first = position + 1 if position is not None else None
+        elif values is not None:
+            self.first = max(position - len(items), 1) \
+                if position is not None else None
+        else:
+            self.first = max(total - len(items), 0) + 1 \
+                if total is not None else None
+
+    @staticmethod
+    def _serializer():
+        return URLSafeSerializer(current_app.config['SECRET_KEY'],
+                                 salt='pagination')
+
+    def _load_cursor(self, cursor):
+        if cursor == 'last':
+            return 'prev', None, None
+        if not cursor:
+            return 'next', None, None
+        try:
+            data = self._serializer().loads(cursor)
+            values = [_load_value(value) for value in data['k']]
+            position = data.get('n')
+        except (AttributeError, BadSignature, KeyError, TypeError,
+                ValueError):
+            return 'next', None, None
+        if len(values) != len(self.keys) or \
+                not isinstance(position, (int, type(None))):
+            return 'next', None, None
+        return data['d'], values, position
+
+    def _dump_cursor(self, direction, item, position):
+        values = [_dump_value(getattr(item, attribute))
+                  for attribute in self.attributes]
+        return self._serializer().dumps(
+            {'d': direction, 'k': values, 'n': position})
+
+    def _after(self, values, backwards):
+        """Build the condition for rows that come after ``values``."""
+        def beyond(column, descending, value, inclusive=False):
+            if descending != backwards:
+                return column <= value if inclusive else column < value
+            return column >= value if inclusive else column > value
+
+        conditions = []
+        for i, (column, descending) in enumerate(self.keys):
+            conditions.append(db.and_(*(
+                [other == values[j]
+                 for j, (other, _) in enumerate(self.keys[:i])] +
+                [beyond(column, descending, values[i])])))
+        # the bound on the first key lets the database seek in the index
+        first, descending = self.keys[0]
+        return db.and_(beyond(first, descending, values[0], inclusive=True),
+                       db.or_(*conditions))
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        return self._dump_cursor(
+            'next', self.items[-1], self.first + len(self.items) - 1
+            if self.first is not None else None)
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or not self.items:
+            return None
+        return self._dump_cursor('prev', self.items[0], self.first)
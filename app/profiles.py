@@ -0,0 +1,126 @@
+from flask import current_app
+
+FIELDS = ('code', 'name', 'type_name', 'credit', 'score')
+
+profiles = {}
+
+
+class PrefixTrie:
+    """Maps strings to the value of their longest registered prefix.
+
+    A lookup walks at most one node per character of the key, however many
+    prefixes are registered.
+    """
+
+    def __init__(self, items=()):
+        self._root = {}
+        for prefix, value in items:
+            self[prefix] = value
+
+    def __setitem__(self, prefix, value):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        # characters are strings, so None can mark the end of a prefix
+        node[None] = value
+
+    def longest_match(self, key, default=None):
+        node = self._root
+        value = node.get(None, default)
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                break
+            value = node.get(None, value)
+        return value
+
+
+class UniversityProfile:
+    """How to read the transcript of a university and classify its courses.
+
+    ``columns`` maps each of ``FIELDS`` to the index of its cell in a
+    transcript row. ``types`` maps the course type names of the transcript
+    to course types, ``prefixes`` overrides them for the course codes
+    starting with a prefix, and ``zero_credit`` for the courses without
+    credits, both keyed by type name. Unknown type names get ``default``.
+
+    The rules are compiled once into a dispatch table of type names, each
+    with a prefix trie of the course codes.
+    """
+
+    def __init__(self, name, columns, types, default, prefixes=None,
+                 zero_credit=None):
+        missing = set(FIELDS) - set(columns)
+        if missing:
+            raise ValueError('missing columns: %s'
+                             % ', '.join(sorted(missing)))
+        self.name = name
+        self.columns = columns
+        self.default = default
+        prefixes = prefixes or {}
+        zero_credit = zero_credit or {}
+        self._dispatch = {}
+        for type_name in set(types) | set(prefixes) | set(zero_credit):
+            trie = PrefixTrie(prefixes.get(type_name, {}).items())
+            trie[''] = types.get(type_name, default)
+            self._dispatch[type_name] = (zero_credit.get(type_name), trie)
+
+    def classify(self, type_name, code, credit):
+        entry = self._dispatch.get(type_name)
+        if entry is None:
+            return self.default
+        zero_credit, trie = entry
+        if credit == 0 and zero_credit is not None:
+            return zero_credit
+        return trie.longest_match(code)
+
+    def _extract(self, cells):
+        code, name, type_name, credit, score = \
+            (cells[self.columns[field]] for field in FIELDS)
+        try:
+            credit = int(credit)
+        except ValueError:
+            credit = 0
+        try:
+            score = float(score)
+        except ValueError:
+            score = 0.0
+        return code, name, type_name, credit, score
+
+    def parse_rows(self, rows):
+        """Parse and classify a batch of transcript rows.
+
+        Returns the course attributes of every row, or ``None`` for the
+        rows with missing cells.
+        """
+        extracted = []
+        for cells in rows:
+            try:
+                extracted.append(self._extract(cells))
+            except IndexError:
+                extracted.append(None)
+        classify = self.classify
+        return [None if row is None else
+                {'code': row[0], 'name': row[1], 'credit': row[3],
+                 'score': row[4], 'type_id': classify(row[2], row[0], row[3])}
+                for row in extracted]
+
+    def parse_row(self, cells):
+        code, name, type_name, credit, score = self._extract(cells)
+        return {'code': code, 'name': name, 'credit': credit, 'score': score,
+                'type_id': self.classify(type_name, code, credit)}
+
+
+def register_profile(profile):
+    profiles[profile.name] = profile
+    return profile
+
+
+def get_profile(name=None):
+    """Return a profile, by default the one of ``APP_UNIVERSITY_PROFILE``."""
+    if name is None:
+        name = current_app.config['APP_UNIVERSITY_PROFILE']
+    try:
+        return profiles[name]
+    except KeyError:
+        raise ValueError('unknown university profile: %s' % name)
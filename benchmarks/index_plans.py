@@ -0,0 +1,175 @@
+"""Compare query plans and timings without and with the composite indexes.
+
+Generates a large random dataset in a scratch SQLite database, then runs
+the queries behind the blog and info views twice: once with only the
+indexes of the first two migrations, and once with every index the models
+declare. Usage::
+
+    python -m benchmarks.index_plans [--scale 1.0] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.models import Comment, Course, Follow, Post, User
+
+# indexes that did not exist after migration 39f7cabba3b2
+NEW_INDEXES = (
+    'ix_courses_fingerprint',
+    'ix_courses_user_term_type',
+    'ix_posts_author_timestamp',
+    'ix_comments_post_timestamp',
+    'ix_comments_author_id',
+    'ix_follows_follower_timestamp',
+    'ix_follows_followed_timestamp',
+)
+
+
+def generate(scale, seed=42):
+    rnd = random.Random(seed)
+    start = datetime(2018, 9, 1)
+    n_users = int(2000 * scale)
+    n_posts = int(100000 * scale)
+    n_comments = int(200000 * scale)
+    n_follows = int(40000 * scale)
+    n_courses = int(100000 * scale)
+
+    def insert(table, rows):
+        for i in range(0, len(rows), 10000):
+            db.session.execute(table.insert(), rows[i:i + 10000])
+
+    insert(User.__table__, [
+        {'id': i, 'email': 'user%d@example.com' % i,
+         'username': 'user%d' % i, 'confirmed': True}
+        for i in range(1, n_users + 1)])
+    insert(Post.__table__, [
+        {'id': i, 'body': 'post %d' % i, 'author_id': rnd.randint(1, n_users),
+         'timestamp': start + timedelta(minutes=rnd.randint(0, 10 ** 6))}
+        for i in range(1, n_posts + 1)])
+    insert(Comment.__table__, [
+        {'body': 'comment', 'author_id': rnd.randint(1, n_users),
+         'post_id': rnd.randint(1, n_posts), 'disabled': False,
+         'timestamp': start + timedelta(minutes=rnd.randint(0, 10 ** 6))}
+        for _ in range(n_comments)])
+    follows = set()
+    while len(follows) < n_follows:
+        follower, followed = rnd.randint(1, n_users), rnd.randint(1, n_users)
+        if follower != followed:
+            follows.add((follower, followed))
+    insert(Follow.__table__, [
+        {'follower_id': follower, 'followed_id': followed,
+         'timestamp': start + timedelta(minutes=rnd.randint(0, 10 ** 6))}
+        for follower, followed in sorted(follows)])
+    insert(Course.__table__, [
+        {'user_id': rnd.randint(1, n_users), 'name': 'course %d' % i,
+         'term': rnd.randint(1, 8), 'type_id': rnd.randint(1, 8),
+         'credit': rnd.randint(0, 5), 'score': rnd.uniform(50, 100)}
+        for i in range(n_courses)])
+    db.session.commit()
+
+
+def workload():
+    """Return the queries issued by the views, as (name, query) pairs."""
+    user = User.query.get(1)
+    post = db.session.query(Comment.post_id).group_by(Comment.post_id) \
+        .order_by(db.func.count().desc()).first()[0]
+    own_posts = Post.query.filter_by(author_id=user.id)
+    return [
+        ('blog.user: posts of a user',
+         user.posts.order_by(Post.timestamp.desc()).limit(20)),
+        ('blog.index: followed posts',
+         user.followed_posts.union(own_posts)
+         .order_by(Post.timestamp.desc()).limit(20)),
+        ('blog.post: comments of a post',
+         Comment.query.filter_by(post_id=post)
+         .order_by(Comment.timestamp.asc()).limit(30)),
+        ('blog.user: comment count of a user',
+         db.session.query(db.func.count(Comment.id))
+         .filter(Comment.author_id == user.id)),
+        ('blog.followers: followers of a user',
+         user.followers.order_by(Follow.timestamp.desc()).limit(50)),
+        ('blog.followed_by: users followed by a user',
+         user.followed.order_by(Follow.timestamp.desc()).limit(50)),
+        ('info.courses: first page of courses',
+         user.courses.order_by(Course.term.desc(), Course.type_id.asc(),
+                               Course.id.asc()).limit(20)),
+        ('info.courses: courses of some terms',
+         user.courses.filter(Course.term.in_([3, 4, 5]))),
+    ]
+
+
+def explain(query):
+    statement = query.statement.compile(
+        db.engine, compile_kwargs={'literal_binds': True})
+    rows = db.session.execute('EXPLAIN QUERY PLAN %s' % statement)
+    return [row[-1] for row in rows]
+
+
+def measure(query, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        query.all()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def run(repeat):
+    indexes = [index for table in db.metadata.tables.values()
+               for index in table.indexes if index.name in NEW_INDEXES]
+    results = {}
+    for phase in ('before', 'after'):
+        for index in indexes:
+            if phase == 'before':
+                index.drop(db.engine)
+            else:
+                index.create(db.engine)
+        db.session.execute('ANALYZE')
+        for name, query in workload():
+            results.setdefault(name, {})[phase] = \
+                (explain(query), measure(query, repeat))
+    return results
+
+
+def report(results):
+    for name, phases in results.items():
+        (plan_before, ms_before), (plan_after, ms_after) = \
+            phases['before'], phases['after']
+        print('%s: %.3f ms -> %.3f ms (%.1fx)'
+              % (name, ms_before, ms_after, ms_before / max(ms_after, 1e-6)))
+        for phase, plan in (('before', plan_before), ('after', plan_after)):
+            for line in plan:
+                print('    %-6s %s' % (phase, line))
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='dataset size relative to 100,000 posts')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='runs of each query per phase')
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+    try:
+        with app.app_context():
+            db.create_all()
+            generate(args.scale)
+            report(run(args.repeat))
+            db.session.remove()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""Benchmark the transcript import, the statistics and the info views.
+
+Fixtures are generated from a fixed seed in a scratch SQLite database.
+Every case reports its throughput, p50/p95/p99 latency and the number of
+SQL statements it runs. The statement counts do not depend on the machine
+and are compared with the checked in baseline; the run fails when a case
+runs more of them. Timings are only compared with a timing baseline saved
+on the same machine with ``--timings FILE --save``, and fail the run when
+a p50 latency regresses by more than the threshold. Timing baselines are
+not checked in, ``benchmarks/*_timings.json`` is ignored by git. Usage::
+
+    python -m benchmarks.info [--iterations 1.0] [--threshold 0.25]
+                              [--baseline FILE] [--timings FILE] [--save]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from app import create_app, db
+from app.info.views import get_statistics
+from app.models import Course, CourseStat, Role, TermPrefixSums, User
+
+SEED = 2018
+TRANSCRIPT_ROWS = (50, 500, 5000)
+COURSE_COUNTS = (10, 100, 1000, 10000)
+TYPE_NAMES = ('通识', '通修', '平台', '核心', '选修', '公选')
+BASELINE = os.path.join(os.path.dirname(__file__), 'info_baseline.json')
+
+
+class QueryCounter:
+    """Counts the statements sent to the database."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context,
+                 executemany):
+        self.count += 1
+
+
+queries = QueryCounter()
+
+
+def transcript(rnd, rows):
+    trs = ''.join(
+        '<tr><td>%d</td><td>%08d</td><td>课程%d</td><td>-</td><td>%s</td>'
+        '<td>%d</td><td>%s</td></tr>'
+        % (i, rnd.randint(0, 10 ** 8 - 1), i, rnd.choice(TYPE_NAMES),
+           rnd.randint(0, 5), rnd.choice(('%d' % rnd.randint(60, 100),
+                                          '%.1f' % rnd.uniform(60, 100),
+                                          '通过')))
+        for i in range(1, rows + 1))
+    return ('<html><head><meta http-equiv="Content-Type" '
+            'content="text/html; charset=utf-8"></head><body><table><tr><td>'
+            '<table><tr><td>学生信息</td></tr></table>'
+            '<table><tr><th>序号</th><th>课程号</th><th>课程名称</th>'
+            '<th>英文名称</th><th>类型</th><th>学分</th><th>总评</th></tr>'
+            '%s</table></td></tr></table></body></html>' % trs).encode('utf-8')
+
+
+def create_users(rnd):
+    """Create a confirmed user ``user<n>`` with n courses for every count."""
+    Role.insert_roles()
+    users = {}
+    for count in COURSE_COUNTS:
+        users[count] = User(email='user%d@example.com' % count,
+                            username='user%d' % count, password='cat',
+                            confirmed=True)
+    db.session.add_all(users.values())
+    db.session.commit()
+    for count, user in users.items():
+        db.session.execute(Course.__table__.insert(), [
+            {'user_id': user.id, 'name': '课程%d' % i,
+             'term': rnd.randint(1, 8), 'type_id': rnd.randint(1, 8),
+             'credit': rnd.randint(0, 5), 'score': rnd.uniform(60, 100)}
+            for i in range(count)])
+    CourseStat.rebuild()
+    db.session.commit()
+    return users
+
+
+def percentile(timings, p):
+    """Return the nearest rank percentile of sorted ``timings``."""
+    rank = max(int(round(p / 100.0 * len(timings))), 1)
+    return timings[rank - 1]
+
+
+def measure(func, iterations, items=1, unit='ops', warmup=2):
+    for _ in range(warmup):
+        func()
+    timings = []
+    counts = []
+    for _ in range(iterations):
+        count = queries.count
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+        counts.append(queries.count - count)
+    timings.sort()
+    return {'iterations': iterations,
+            'throughput': round(items * iterations / sum(timings), 1),
+            'unit': '%s/s' % unit,
+            'queries': max(counts),
+            'p50': round(percentile(timings, 50) * 1000, 3),
+            'p95': round(percentile(timings, 95) * 1000, 3),
+            'p99': round(percentile(timings, 99) * 1000, 3)}
+
+
+def run(app, scale):
+    rnd = random.Random(SEED)
+    results = {}
+
+    def iterations(n):
+        return max(int(n * scale), 5)
+
+    for rows in TRANSCRIPT_ROWS:
+        markup = transcript(rnd, rows)
+        results['fetch_courses[%d rows]' % rows] = measure(
+            lambda: Course.fetch_courses(io.BytesIO(markup)),
+            iterations(100000 // rows), items=rows, unit='rows')
+
+    users = create_users(rnd)
+    for count, user in users.items():
+        def statistics():
+            TermPrefixSums.cache.clear()
+            get_statistics(user, 1, 8)
+        results['get_statistics[%d courses]' % count] = measure(
+            statistics, iterations(500))
+
+    for count, user in users.items():
+        client = app.test_client()
+        client.post('/auth/login', data={'email': user.email,
+                                         'password': 'cat'})
+        for url in ('/info/courses', '/info/statistics'):
+            def get():
+                response = client.get(url)
+                assert response.status_code == 200, response.status
+            results['GET %s[%d courses]' % (url, count)] = measure(
+                get, iterations(100))
+    return results
+
+
+def compare(results, baseline, timings, threshold):
+    """Return the cases that run more statements or regressed in p50."""
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and \
+                result['queries'] > baseline[name]['queries']:
+            regressions.append((name, 'statements', baseline[name]['queries'],
+                                result['queries']))
+        if name in timings and \
+                result['p50'] > timings[name]['p50'] * (1 + threshold):
+            regressions.append((name, 'p50 ms', timings[name]['p50'],
+                                result['p50']))
+    return regressions
+
+
+def report(results, baseline, timings):
+    print('%-40s %14s %10s %10s %10s %10s %10s' % (
+        'case', 'throughput', 'p50 ms', 'p95 ms', 'p99 ms', 'base p50',
+        'queries'))
+    for name, result in results.items():
+        base = timings.get(name)
+        queries = '%d' % result['queries']
+        if name in baseline:
+            queries += ' (%d)' % baseline[name]['queries']
+        print('%-40s %10.1f %-3s %10.3f %10.3f %10.3f %10s %10s' % (
+            name, result['throughput'], result['unit'].split('/')[0],
+            result['p50'], result['p95'], result['p99'],
+            '%.3f' % base['p50'] if base else '-', queries))
+
+
+def load(path):
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print('Saved to %s.' % path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=float, default=1.0,
+                        help='scale the number of iterations of every case')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed p50 regression, 0.25 is 25%%')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='baseline JSON file of the statement counts')
+    parser.add_argument('--timings',
+                        help='timing baseline JSON file of this machine')
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the new baselines')
+    args = parser.parse_args()
+
+    baseline = load(args.baseline)
+    timings = load(args.timings)
+
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.config['SQLALCHEMY_RECORD_QUERIES'] = False
+    try:
+        with app.app_context():
+            db.create_all()
+            db.event.listen(db.engine, 'before_cursor_execute', queries)
+            results = run(app, args.iterations)
+            db.session.remove()
+    finally:
+        os.remove(path)
+
+    report(results, baseline, timings)
+    if args.save:
+        print()
+        save(args.baseline, {name: {'queries': result['queries']}
+                             for name, result in results.items()})
+        if args.timings:
+            save(args.timings, {name: {'p50': result['p50']}
+                                for name, result in results.items()})
+        return
+    regressions = compare(results, baseline, timings, args.threshold)
+    for name, what, before, after in regressions:
+        print('\nREGRESSION %s: %s %s -> %s' % (name, what, before, after))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
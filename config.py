@@ -20,7 +20,17 @@ class Config:
     APP_POSTS_PER_PAGE = 20
     APP_FOLLOWERS_PER_PAGE = 50
     APP_COMMENTS_PER_PAGE = 30
+    # followers above which posts are no longer copied to their timelines
+    APP_TIMELINE_FAN_OUT_LIMIT = 1000
     APP_COURSES_PER_PAGE = 20
+    # import jobs run in threads of the web process and are kept in its
+    # memory, so it has to be a single worker process (see the Procfile)
+    APP_IMPORT_WORKERS = int(os.environ.get('APP_IMPORT_WORKERS', '2'))
+    APP_IMPORT_SPOOL_DIR = os.environ.get('APP_IMPORT_SPOOL_DIR')
+    APP_WHAT_IF_MAX_COURSES = 100
+    # score distributions of smaller cohorts could give away single scores
+    APP_MIN_COHORT_SIZE = 5
+    APP_UNIVERSITY_PROFILE = os.environ.get('APP_UNIVERSITY_PROFILE', 'nju')
     APP_SLOW_DB_QUERY_TIME = 0.5
     SSL_REDIRECT = False
 
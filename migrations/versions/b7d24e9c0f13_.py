@@ -0,0 +1,26 @@
+"""add course list index for keyset pagination
+
+Revision ID: b7d24e9c0f13
+Revises: 8a3f6d2b71c4
+Create Date: 2026-10-18 13:26:54.204713
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d24e9c0f13'
+down_revision = '8a3f6d2b71c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_courses_user_term_type', 'courses',
+                    ['user_id', sa.text('term DESC'), 'type_id', 'id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_courses_user_term_type', table_name='courses')
@@ -0,0 +1,80 @@
+"""add catalog courses
+
+Revision ID: e5b8a1c3f742
+Revises: d41c8b5e2a96
+Create Date: 2026-10-18 16:21:44.108375
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8a1c3f742'
+down_revision = 'd41c8b5e2a96'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('catalog_courses',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('code', sa.String(length=32), nullable=False),
+    sa.Column('name', sa.String(length=128), nullable=False),
+    sa.Column('credit', sa.Integer(), nullable=True),
+    sa.Column('type_id', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_catalog_courses_code_name', 'catalog_courses',
+                    ['code', 'name'], unique=True)
+    op.add_column('courses', sa.Column('catalog_id', sa.Integer(),
+                                       nullable=True))
+
+    # move the names of the imported courses to the catalog
+    op.execute('INSERT INTO catalog_courses (code, name, credit, type_id) '
+               'SELECT code, name, MAX(credit), MIN(type_id) FROM courses '
+               'WHERE code IS NOT NULL AND name IS NOT NULL '
+               'GROUP BY code, name')
+    op.execute('UPDATE courses SET catalog_id = ('
+               'SELECT catalog_courses.id FROM catalog_courses '
+               'WHERE catalog_courses.code = courses.code '
+               'AND catalog_courses.name = courses.name), name = NULL '
+               'WHERE code IS NOT NULL AND name IS NOT NULL')
+
+    # SQLite recreates the table and would lose the DESC of this index
+    op.drop_index('ix_courses_user_term_type', table_name='courses')
+    op.drop_index('ix_courses_fingerprint', table_name='courses')
+    with op.batch_alter_table('courses') as batch_op:
+        batch_op.create_foreign_key('fk_courses_catalog_id', 'catalog_courses',
+                                    ['catalog_id'], ['id'])
+        batch_op.drop_column('code')
+    op.create_index('ix_courses_fingerprint', 'courses',
+                    ['user_id', 'term', 'catalog_id'], unique=True)
+    op.create_index('ix_courses_user_term_type', 'courses',
+                    ['user_id', sa.text('term DESC'), 'type_id', 'id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_courses_user_term_type', table_name='courses')
+    op.drop_index('ix_courses_fingerprint', table_name='courses')
+    op.add_column('courses', sa.Column('code', sa.String(length=32),
+                                       nullable=True))
+    op.execute('UPDATE courses SET name = ('
+               'SELECT catalog_courses.name FROM catalog_courses '
+               'WHERE catalog_courses.id = courses.catalog_id) '
+               'WHERE catalog_id IS NOT NULL AND name IS NULL')
+    op.execute('UPDATE courses SET code = ('
+               'SELECT catalog_courses.code FROM catalog_courses '
+               'WHERE catalog_courses.id = courses.catalog_id) '
+               'WHERE catalog_id IS NOT NULL')
+    with op.batch_alter_table('courses') as batch_op:
+        batch_op.drop_constraint('fk_courses_catalog_id', type_='foreignkey')
+        batch_op.drop_column('catalog_id')
+    op.create_index('ix_courses_fingerprint', 'courses',
+                    ['user_id', 'term', 'code', 'name'], unique=True)
+    op.create_index('ix_courses_user_term_type', 'courses',
+                    ['user_id', sa.text('term DESC'), 'type_id', 'id'],
+                    unique=False)
+    op.drop_index('ix_catalog_courses_code_name', table_name='catalog_courses')
+    op.drop_table('catalog_courses')
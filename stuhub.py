@@ -14,7 +14,9 @@ from flask_migrate import Migrate, upgrade
 import app.fake as fake
 from app import create_app, db
 from app.models import (Comment, Follow, Permission, Post, Role,
-                        User, Course, CourseType)
+                        User, Course, CourseScoreBin, CourseStat, CourseType,
+                        gpa_ranking)
+from app.profiles import get_profile
 
 app = create_app(os.getenv('APP_CONFIG') or 'default')
 migrate = Migrate(app, db)
@@ -29,6 +31,7 @@ def inject_app_name():
 def make_shell_context():
     return dict(db=db, User=User, Role=Role, Permission=Permission,
                 Post=Post, Comment=Comment, Course=Course,
+                CourseStat=CourseStat, CourseScoreBin=CourseScoreBin,
                 CourseType=CourseType)
 
 
@@ -81,3 +84,154 @@ def deploy():
 def fake_data():
     fake.users()
     fake.posts(200)
+
+
+@app.cli.command('rebuild-course-stats')
+@click.option('--username', default=None,
+              help='Only rebuild the statistics of this user.')
+def rebuild_course_stats(username):
+    """Rebuild the course statistics table from the courses."""
+    user_id = None
+    if username is not None:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.BadParameter('no such user: %s' % username)
+        user_id = user.id
+    CourseStat.rebuild(user_id)
+    db.session.commit()
+
+
+@app.cli.command('rebuild-score-bins')
+def rebuild_score_bins():
+    """Rebuild the score bins of the catalog courses from the courses."""
+    CourseScoreBin.rebuild()
+    db.session.commit()
+
+
+@app.cli.command()
+def recount():
+    """Recount the post, comment and follow counters and repair drift."""
+    drifted = User.recount()
+    db.session.commit()
+    for counter, count in sorted(drifted.items()):
+        click.echo('%s: %d repaired' % (counter, count))
+
+
+@app.cli.command('gpa-rank')
+@click.argument('username')
+def gpa_rank(username):
+    """Show the GPA rank and percentile of a user."""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.BadParameter('no such user: %s' % username)
+    result = gpa_ranking.rank(user.id)
+    if result is None:
+        print('%s has no credits yet.' % username)
+        return
+    for metric, rank in result.items():
+        if rank is None:
+            print('%s: no credits' % metric)
+            continue
+        print('%s: %.3f, rank %d of %d, percentile %.2f%%'
+              % (metric, rank['gpa'], rank['rank'], rank['total'],
+                 rank['percentile']))
+
+
+@app.cli.command('export-statistics')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--term-from', default=1, help='First term to include.')
+@click.option('--term-to', default=8, help='Last term to include.')
+def export_statistics(output, term_from, term_to):
+    """Export the course statistics of every user to a CSV file."""
+    from app.info.batch import batch_statistics, write_csv
+    with open(output, 'w', newline='', encoding='utf-8-sig') as f:
+        write_csv(f, batch_statistics(term_from, term_to))
+
+
+@app.cli.command('import-courses')
+@click.argument('term', type=int)
+@click.argument('transcripts', nargs=-1, type=click.File('rb'))
+@click.option('--profile', default=None,
+              help='University profile of the transcripts.')
+def import_courses(term, transcripts, profile):
+    """Import transcripts named <username>.html for a term."""
+    try:
+        profile = get_profile(profile)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    for transcript in transcripts:
+        username = os.path.splitext(os.path.basename(transcript.name))[0]
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            db.session.rollback()
+            raise click.BadParameter('no such user: %s' % username)
+        result = Course.bulk_import(
+            user.id, term, Course.iter_transcript_rows(transcript),
+            profile=profile)
+        print('%s: %d inserted, %d updated, %d skipped, %d failed'
+              % ((username,) + result))
+    db.session.commit()
+
+
+@app.cli.command('purge-courses')
+@click.argument('usernames', nargs=-1, required=True)
+@click.option('--term', default=None, type=int,
+              help='Only delete the courses of this term.')
+@click.option('--type-id', default=None, type=int,
+              help='Only delete the courses of this type.')
+def purge_courses(usernames, term, type_id):
+    """Delete the courses of many users at once."""
+    users = User.query.filter(User.username.in_(usernames)).all()
+    missing = set(usernames) - set(user.username for user in users)
+    if missing:
+        raise click.BadParameter('no such user: %s'
+                                 % ', '.join(sorted(missing)))
+    count = Course.bulk_delete([user.id for user in users], term, type_id)
+    db.session.commit()
+    print('%d courses deleted.' % count)
+
+
+@app.cli.command('index-advisor')
+@click.option('--username', default=None,
+              help='Browse as this user instead of an administrator.')
+@click.option('--verbose', is_flag=True,
+              help='Show the plans of the queries without issues too.')
+def index_advisor(username, verbose):
+    """Explain the queries of every view and suggest missing indexes.
+
+    Exits with status 1 when an index is suggested.
+    """
+    from app.advisor import (advise, capture_queries, index_ddl,
+                             merge_suggestions, sample_user, workload_urls)
+    if username is not None:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.BadParameter('no such user: %s' % username)
+    else:
+        user = sample_user()
+        if user is None:
+            raise click.UsageError('no users in the database')
+    urls, skipped = workload_urls(app, user)
+    queries = capture_queries(app, user, urls)
+    print('%d queries from %d views as %s, skipped %s.'
+          % (len(queries), len(urls), user.username,
+             ', '.join(skipped) or 'none'))
+    suggestions = []
+    for advice in advise(queries):
+        if not advice.issues and not verbose:
+            continue
+        print('\n%s\n  views: %s' % (advice.statement, ', '.join(advice.urls)))
+        for line in advice.plan:
+            print('  plan: %s' % line)
+        for issue in advice.issues:
+            print('  %s: %s' % (issue.kind, issue.detail))
+        for suggestion in advice.suggestions:
+            print('  suggest: %s' % index_ddl(suggestion))
+            if suggestion not in suggestions:
+                suggestions.append(suggestion)
+    if suggestions:
+        print('\nSuggested indexes:')
+        for suggestion in merge_suggestions(suggestions):
+            print('  %s;' % index_ddl(suggestion))
+        sys.exit(1)
+    print('\nNo missing indexes found.')
@@ -0,0 +1,12 @@
+def transcript(rows, charset='utf-8'):
+    trs = ''.join(
+        '<tr><td>%d</td><td>%s</td><td>%s</td><td>-</td><td>%s</td>'
+        '<td>%s</td><td>%s</td></tr>' % ((i,) + row)
+        for i, row in enumerate(rows, 1))
+    return ('<html><head><meta http-equiv="Content-Type" '
+            'content="text/html; charset=%s"></head><body><table><tr><td>'
+            '<table><tr><td>学生信息</td></tr></table>'
+            '<table><tr><th>序号</th><th>课程号</th><th>课程名称</th>'
+            '<th>英文名称</th><th>类型</th><th>学分</th><th>总评</th></tr>'
+            '%s</table></td></tr></table></body></html>'
+            % (charset, trs)).encode(charset)
@@ -0,0 +1,108 @@
+import unittest
+
+from app import create_app, db
+from app.advisor import (INDEX_SCAN, SCAN, SORT, advise, capture_queries,
+                         explain, merge_suggestions, plan_issues,
+                         suggest_index, workload_urls)
+from app.models import Comment, Course, Post, Role, User
+
+
+class IndexAdvisorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        other = User(email='susan@example.com', username='susan',
+                     password='dog', confirmed=True)
+        db.session.add_all([self.user, other])
+        db.session.commit()
+        self.user.follow(other)
+        post = Post(body='hello', author=other)
+        db.session.add_all([
+            post, Comment(body='hi', post=post, author=self.user),
+            Course(name='math', credit=4, score=90, term=1, type_id=1,
+                   user=self.user)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_plan_issues(self):
+        issues = plan_issues([
+            'SCAN comments',
+            'SCAN posts USING INDEX ix_posts_timestamp',
+            'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)',
+            'SCAN anon_1',
+            'USE TEMP B-TREE FOR ORDER BY'])
+        self.assertTrue([(issue.kind, issue.table) for issue in issues] ==
+                        [(SCAN, 'comments'), (INDEX_SCAN, 'posts'),
+                         (SORT, None)])
+        issues = plan_issues([
+            'Limit  (cost=1.05..1.06 rows=1 width=44)',
+            '  ->  Sort  (cost=1.05..1.06 rows=1 width=44)',
+            '        Sort Key: "timestamp"',
+            '        ->  Seq Scan on comments  (cost=0.00..1.04 rows=1)'],
+            'postgresql')
+        self.assertTrue([(issue.kind, issue.table) for issue in issues] ==
+                        [(SORT, None), (SCAN, 'comments')])
+
+    def test_explain(self):
+        # the plan is not reused from an earlier EXPLAIN on the same
+        # connection, as with the single connection of sqlite://
+        statement = ('SELECT comments.id FROM comments '
+                     'WHERE comments.post_id = ? ORDER BY comments.timestamp')
+        self.assertTrue(plan_issues(explain(statement, (1,))) == [])
+        db.session.execute('DROP INDEX ix_comments_post_timestamp')
+        db.session.commit()
+        self.assertTrue(plan_issues(explain(statement, (1,))) != [])
+
+    def test_suggest_index(self):
+        db.session.execute('DROP INDEX ix_comments_post_timestamp')
+        db.session.commit()
+        statement = ('SELECT comments.id FROM comments '
+                     'WHERE ? = comments.post_id '
+                     'ORDER BY comments.timestamp ASC LIMIT ? OFFSET ?')
+        self.assertTrue(suggest_index(statement, 'comments') ==
+                        ('comments', ('post_id', 'timestamp')))
+        # ix_comments_author_id already serves this one
+        statement = ('SELECT count(*) FROM comments '
+                     'WHERE comments.author_id = ?')
+        self.assertTrue(suggest_index(statement, 'comments') is None)
+        # without a filter only sorts get an index
+        statement = ('SELECT course_stats.user_id FROM course_stats '
+                     'WHERE course_stats.term BETWEEN ? AND ?')
+        self.assertTrue(suggest_index(statement, 'course_stats') is None)
+        self.assertTrue(merge_suggestions([
+            ('comments', ('post_id',)),
+            ('comments', ('post_id', 'timestamp'))]) ==
+            [('comments', ('post_id', 'timestamp'))])
+
+    def test_workload(self):
+        db.session.add(Post(body='bye', author=self.user))
+        db.session.commit()
+        urls, skipped = workload_urls(self.app, self.user)
+        self.assertTrue('/blog/user/john' in urls)
+        self.assertTrue(any(url.startswith('/blog/index?cursor=')
+                            for url in urls))
+        self.assertTrue('/info/courses' in urls)
+        self.assertTrue('blog.follow' in skipped)
+        self.assertTrue('info.import_job' in skipped)
+        queries = capture_queries(self.app, self.user, urls)
+        self.assertTrue(any('FROM courses' in statement
+                            for statement in queries))
+        suggestions = [suggestion for advice in advise(queries)
+                       for suggestion in advice.suggestions]
+        self.assertTrue(suggestions == [])
+
+        db.session.execute('DROP INDEX ix_comments_post_timestamp')
+        db.session.commit()
+        suggestions = [suggestion for advice in advise(queries)
+                       for suggestion in advice.suggestions]
+        self.assertTrue(('comments', ('post_id', 'timestamp', 'id')) in
+                        suggestions)
@@ -0,0 +1,51 @@
+import unittest
+
+from app import create_app, db
+from app.info.batch import HEADER, batch_statistics
+from app.info.views import get_statistics
+from app.models import Course, CourseType, TermPrefixSums, User
+
+
+class BatchStatisticsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        TermPrefixSums.cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_batch_statistics(self):
+        users = []
+        for i in range(3):
+            u = User(email='user%d@example.com' % i,
+                     username='user%d' % i, password='cat')
+            db.session.add(u)
+            users.append(u)
+        for i in range(40):
+            u = users[i % 2]
+            db.session.add(Course(credit=i % 4, score=50 + i, term=i % 8 + 1,
+                                  type_id=i % 8 + 1, user=u))
+        for i in range(6):
+            db.session.add(Course(credit=0, score=None, term=1, user=users[0],
+                                  type_id=CourseType.READING))
+        # unknown types count towards the totals only, untyped courses not
+        db.session.add_all([
+            Course(credit=3, score=60, term=2, user=users[1], type_id=9),
+            Course(credit=2, score=70, term=3, user=users[1], type_id=0),
+            Course(credit=5, score=99, term=2, user=users[1])])
+        db.session.commit()
+        for term_from, term_to in ((1, 8), (2, 5)):
+            rows = batch_statistics(term_from, term_to)
+            self.assertTrue(len(rows) == 3)
+            for u, row in zip(users, rows):
+                self.assertTrue(row[:2] == [u.id, u.username])
+                expected = get_statistics(u, term_from, term_to)
+                self.assertTrue(dict(zip(HEADER[2:], row[2:])) == expected)
+        row = dict(zip(HEADER, batch_statistics()[1]))
+        self.assertTrue(row['总学分'] ==
+                        str(sum(i % 4 for i in range(1, 40, 2)) + 5))
@@ -1,7 +1,12 @@
+import io
 import unittest
 
+from flask_sqlalchemy import get_debug_queries
+
 from app import create_app, db
-from app.models import Course, User, CourseType
+from app.models import (CatalogCourse, Course, CourseStat, CourseStatistics,
+                        CourseType, Role, TermPrefixSums, User, gpa_ranking)
+from tests.fixtures import transcript
 
 
 class CourseModelTestCase(unittest.TestCase):
@@ -10,6 +15,9 @@ class CourseModelTestCase(unittest.TestCase):
         self.app_context = self.app.app_context()
         self.app_context.push()
         db.create_all()
+        TermPrefixSums.cache.clear()
+        CatalogCourse.cache.clear()
+        gpa_ranking.reset()
         db.session.add(Course(credit=1, score=90,
                               type_id=CourseType.GENERAL))
         db.session.add(Course(credit=2, score=75,
@@ -40,4 +48,398 @@ class CourseModelTestCase(unittest.TestCase):
         for i in range(0, 6):
             courses.append(Course(credit=0, type_id=CourseType.READING))
         self.assertTrue(Course.total_credit(courses) == 9)
-        self.assertTrue(Course.general_course_credit(courses) == 5)
\ No newline at end of file
+        self.assertTrue(Course.general_course_credit(courses) == 5)
+
+    def test_statistics_object(self):
+        stats = CourseStatistics.from_courses(Course.query.all())
+        self.assertTrue(Course.statistics(stats) is stats)
+        self.assertTrue(stats.count() == 5)
+        self.assertTrue(stats.credit((CourseType.GENERAL,)) == 3)
+        self.assertTrue(abs(Course.comprehensive_gpa(stats) - 3.428) < 1e-2)
+        summary = stats.summary()
+        self.assertTrue(summary['专业GPA'] == '3.000')
+        self.assertTrue(summary['总学分'] == '7')
+
+    def test_statistics_from_query(self):
+        stats = CourseStatistics.from_query(Course.query)
+        expected = CourseStatistics.from_courses(Course.query.all())
+        self.assertTrue(stats.summary() == expected.summary())
+        self.assertTrue(stats.count((CourseType.PRO_BASIC,)) == 2)
+
+    def test_course_stats(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.add(Course(credit=2, score=80, term=1, user=u,
+                              type_id=CourseType.PRO_CORE))
+        db.session.add(Course(credit=3, score=90, term=1, user=u,
+                              type_id=CourseType.PRO_CORE))
+        c = Course(credit=1, score=60, term=2, user=u,
+                   type_id=CourseType.GENERAL)
+        db.session.add(c)
+        db.session.commit()
+        stat = CourseStat.query.get((u.id, 1, CourseType.PRO_CORE))
+        self.assertTrue(stat.course_count == 2)
+        self.assertTrue(stat.credit == 5)
+        self.assertTrue(abs(stat.weighted_score - 430) < 1e-6)
+        c.term = 1
+        c.type_id = CourseType.PRO_CORE
+        db.session.commit()
+        self.assertTrue(CourseStat.query.get((u.id, 2, CourseType.GENERAL))
+                        is None)
+        stat = CourseStat.query.get((u.id, 1, CourseType.PRO_CORE))
+        self.assertTrue(stat.course_count == 3)
+        self.assertTrue(abs(stat.weighted_score - 490) < 1e-6)
+        db.session.delete(c)
+        db.session.commit()
+        expected = CourseStatistics.from_query(u.courses).summary()
+        stats = CourseStatistics.from_stats(u.course_stats)
+        self.assertTrue(stats.summary() == expected)
+        CourseStat.rebuild()
+        db.session.commit()
+        stats = CourseStatistics.from_stats(u.course_stats)
+        self.assertTrue(stats.summary() == expected)
+
+    def test_term_prefix_sums(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        for term in range(1, 9):
+            db.session.add(Course(credit=term, score=60 + term, term=term,
+                                  user=u, type_id=CourseType.PRO_CORE))
+            db.session.add(Course(credit=2, score=90, term=term, user=u,
+                                  type_id=CourseType.GENERAL))
+        db.session.commit()
+        prefix_sums = TermPrefixSums.for_user(u.id)
+        self.assertTrue(TermPrefixSums.for_user(u.id) is prefix_sums)
+        ranges = prefix_sums.all_ranges()
+        self.assertTrue(len(ranges) == 36)
+        for (term_from, term_to), stats in ranges.items():
+            query = u.courses.filter(
+                Course.term.between(term_from, term_to))
+            expected = CourseStatistics.from_query(query)
+            self.assertTrue(stats.summary() == expected.summary())
+        db.session.add(Course(credit=1, score=100, term=3, user=u,
+                              type_id=CourseType.PRO_CORE))
+        db.session.commit()
+        self.assertTrue(TermPrefixSums.for_user(u.id) is not prefix_sums)
+        stats = TermPrefixSums.for_user(u.id).range(3, 3)
+        self.assertTrue(stats.credit() == 6)
+
+        # changes made by other processes are seen through the revision
+        prefix_sums = TermPrefixSums.for_user(u.id)
+        stats = CourseStat.__table__
+        users = User.__table__
+        db.session.execute(stats.update().where(db.and_(
+            stats.c.user_id == u.id, stats.c.term == 3,
+            stats.c.type_id == CourseType.PRO_CORE)).values(credit=10))
+        db.session.execute(users.update().where(users.c.id == u.id).values(
+            course_revision=users.c.course_revision + 1))
+        db.session.commit()
+        self.assertTrue(TermPrefixSums.for_user(u.id) is not prefix_sums)
+        self.assertTrue(
+            TermPrefixSums.for_user(u.id).range(3, 3).credit() == 12)
+        prefix_sums = TermPrefixSums.for_user(u.id)
+        CourseStat.rebuild(u.id)
+        self.assertTrue(u.id in db.session.info['changed_course_users'])
+        db.session.commit()
+        self.assertTrue(TermPrefixSums.for_user(u.id) is not prefix_sums)
+        self.assertTrue(
+            TermPrefixSums.for_user(u.id).range(3, 3).credit() == 6)
+
+    def test_trajectory(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.add(Course(credit=4, score=80, term=1, user=u,
+                              type_id=CourseType.PRO_CORE))
+        db.session.add(Course(credit=2, score=95, term=3, user=u,
+                              type_id=CourseType.GENERAL))
+        db.session.commit()
+        trajectory = TermPrefixSums.for_user(u.id).trajectory()
+        self.assertTrue([term['term'] for term in trajectory] ==
+                        list(range(1, 9)))
+        self.assertTrue(trajectory[1]['term_statistics']['total_credit'] == 0)
+        self.assertTrue(trajectory[1]['cumulative_statistics']
+                        ['comprehensive_gpa'] == 4.0)
+        third = trajectory[2]
+        self.assertTrue(third['term_statistics']['general_credit'] == 2)
+        cumulative = third['cumulative_statistics']
+        self.assertTrue(abs(cumulative['comprehensive_gpa'] -
+                            (320 + 190) / 6 / 20) < 1e-6)
+        self.assertTrue(third['cumulative_statistics']['academic_gpa'] == 4.0)
+        self.assertTrue(TermPrefixSums.for_user(u.id).trajectory()
+                        is trajectory)
+
+        # terms after the eighth are covered as well
+        db.session.add(Course(credit=2, score=70, term=10, user=u,
+                              type_id=CourseType.PRO_CORE))
+        db.session.commit()
+        prefix_sums = TermPrefixSums.for_user(u.id)
+        trajectory = prefix_sums.trajectory()
+        self.assertTrue([term['term'] for term in trajectory] ==
+                        list(range(1, 11)))
+        self.assertTrue(trajectory[-1]['cumulative_statistics']
+                        ['total_credit'] == 8)
+        self.assertTrue(prefix_sums.total().credit() == 8)
+        self.assertTrue(len(prefix_sums.all_ranges()) == 55)
+        self.assertTrue(abs(gpa_ranking.rank(u.id)['comprehensive']['gpa'] -
+                            (320 + 190 + 140) / 8 / 20) < 1e-3)
+
+    def test_gpa_ranking(self):
+        users = []
+        for i, score in enumerate((70, 80, 90, 80)):
+            u = User(email='user%d@example.com' % i, password='cat')
+            db.session.add(u)
+            db.session.add(Course(credit=2, score=score, term=1, user=u,
+                                  type_id=CourseType.PRO_CORE))
+            users.append(u)
+        db.session.add(User(email='nocourse@example.com', password='cat'))
+        db.session.commit()
+        rank = gpa_ranking.rank(users[1].id)['comprehensive']
+        self.assertTrue(rank['rank'] == 2)
+        self.assertTrue(rank['total'] == 4)
+        self.assertTrue(rank['percentile'] == 75.0)
+        self.assertTrue(gpa_ranking.rank(users[2].id)['academic']['rank']
+                        == 1)
+        db.session.add(Course(credit=2, score=100, term=2, user=users[0],
+                              type_id=CourseType.PRO_CORE))
+        db.session.commit()
+        rank = gpa_ranking.rank(users[0].id)['comprehensive']
+        self.assertTrue(rank['rank'] == 2)
+        self.assertTrue(abs(rank['gpa'] - 4.25) < 1e-6)
+        self.assertTrue(gpa_ranking.rank(users[2].id)['comprehensive']
+                        ['rank'] == 1)
+
+        # metrics without credits are left out of the ranking
+        u = User(email='general@example.com', password='cat')
+        db.session.add(u)
+        db.session.add(Course(credit=2, score=95, term=1, user=u,
+                              type_id=CourseType.GENERAL))
+        db.session.commit()
+        rank = gpa_ranking.rank(u.id)
+        self.assertTrue(rank['academic'] is None)
+        self.assertTrue(rank['comprehensive']['total'] == 5)
+        self.assertTrue(gpa_ranking.rank(users[1].id)['academic']['total']
+                        == 4)
+
+        # changes made by other processes are seen through the revisions
+        stats = CourseStat.__table__
+        db.session.execute(stats.update().where(
+            stats.c.user_id == users[1].id).values(weighted_score=100))
+        CourseStat.mark_changed(db.session(), [users[1].id])
+        db.session.commit()
+        rank = gpa_ranking.rank(users[1].id)['comprehensive']
+        self.assertTrue(rank['rank'] == 5 and rank['gpa'] == 2.5)
+        self.assertTrue(gpa_ranking.stale == set())
+
+        # unchanged revisions cost a single primary key lookup
+        user_id = users[2].id
+        start = len(get_debug_queries())
+        gpa_ranking.rank(user_id)
+        self.assertTrue(len(get_debug_queries()) - start == 1)
+
+        # the changes of a transaction are reloaded once it ends
+        db.session.add(Course(credit=2, score=60, term=3, user=users[2],
+                              type_id=CourseType.PRO_CORE))
+        db.session.flush()
+        self.assertTrue(gpa_ranking.rank(users[2].id)['comprehensive']
+                        ['rank'] == 4)
+        self.assertTrue(gpa_ranking.stale == {users[2].id})
+        db.session.rollback()
+        self.assertTrue(gpa_ranking.rank(users[2].id)['comprehensive']
+                        ['rank'] == 2)
+
+    def test_fetch_courses(self):
+        rows = [('22000010', '程序设计基础', '核心', '4', '92'),
+                ('00250010', '中国古代文学', '选修', '2', '85.5'),
+                ('37000020', '经典阅读', '选修', '0', '通过'),
+                ('11000030', '大学英语', '通修', '4', '')]
+        for charset in ('utf-8', 'gbk'):
+            courses = Course.fetch_courses(
+                io.BytesIO(transcript(rows, charset)))
+            self.assertTrue([c.name for c in courses] ==
+                            [row[1] for row in rows])
+            self.assertTrue([c.type_id for c in courses] == [
+                CourseType.PRO_CORE, CourseType.GENERAL,
+                CourseType.READING, CourseType.PUBLIC_BASIC])
+            self.assertTrue([c.credit for c in courses] == [4, 2, 0, 4])
+            self.assertTrue([c.score for c in courses] ==
+                            [92.0, 85.5, 0.0, 0.0])
+        markup = transcript(rows).decode('utf-8')
+        self.assertTrue(len(Course.fetch_courses(markup)) == 4)
+        # decoded markup is read as it is, whatever charset it declares
+        markup = transcript(rows, 'gbk').decode('gbk')
+        self.assertTrue([c.name for c in Course.fetch_courses(markup)] ==
+                        [row[1] for row in rows])
+        # parsing writes nothing, and reads the existing catalog entries
+        self.assertTrue(CatalogCourse.query.count() == 0)
+        self.assertTrue(courses[0].catalog.id is None)
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        Course.bulk_import(u.id, 1, iter([
+            ['1', '22000010', '程序设计基础', '-', '核心', '4', '92']]))
+        db.session.commit()
+        courses = Course.fetch_courses(markup)
+        self.assertTrue(courses[0].catalog.id is not None)
+        self.assertFalse(db.session.new)
+        db.session.commit()
+        self.assertTrue(CatalogCourse.query.count() == 1)
+
+    def test_bulk_import(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        rows = [['1', '22000010', '程序设计基础', '-', '核心', '4', '92'],
+                ['2', '22000020', '', '-', '核心', '4', '92'],
+                ['3', '22000030'],
+                ['4', '22000040', '数据结构', '-', '核心', '3', '80']]
+        result = Course.bulk_import(u.id, 2, iter(rows), batch_size=1)
+        db.session.commit()
+        self.assertTrue(result == (2, 0, 1, 1))
+        self.assertTrue(u.courses.filter_by(term=2).count() == 2)
+        self.assertTrue(u.courses.join(CatalogCourse).filter(
+            CatalogCourse.code == '22000040').count() == 1)
+        stat = CourseStat.query.get((u.id, 2, CourseType.PRO_CORE))
+        self.assertTrue(stat.course_count == 2 and stat.credit == 7)
+        self.assertTrue(abs(stat.weighted_score - 608) < 1e-6)
+
+        # importing again only updates the changed scores
+        rows[0][6] = '96'
+        rows.append(rows[3])
+        result = Course.bulk_import(u.id, 2, iter(rows))
+        db.session.commit()
+        self.assertTrue(result == (0, 1, 3, 1))
+        self.assertTrue(u.courses.filter_by(term=2).count() == 2)
+        stat = CourseStat.query.get((u.id, 2, CourseType.PRO_CORE))
+        self.assertTrue(stat.course_count == 2)
+        self.assertTrue(abs(stat.weighted_score - 624) < 1e-6)
+
+    def test_edit_course(self):
+        Role.insert_roles()
+        u = User(email='john@example.com', username='john', password='cat',
+                 confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        rows = [['1', '22000010', '程序设计基础', '-', '核心', '4', '92']]
+        Course.bulk_import(u.id, 1, iter(rows))
+        Course.bulk_import(u.id, 2, iter(rows))
+        db.session.commit()
+        course = u.courses.filter_by(term=2).first()
+        client = self.app.test_client(use_cookies=True)
+        client.post('/auth/login', data={'email': 'john@example.com',
+                                         'password': 'cat'})
+        data = {'name': course.name, 'term': 1, 'type_id': course.type_id,
+                'credit': 4, 'score': 95}
+
+        # moving the course into a term that already has it is refused
+        response = client.post('/info/edit-course/%d' % course.id,
+                               data=data)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue('The term already has this course.' in
+                        response.get_data(as_text=True))
+        self.assertTrue(Course.query.get(course.id).term == 2)
+
+        data['term'] = 3
+        response = client.post('/info/edit-course/%d' % course.id,
+                               data=data)
+        self.assertTrue(response.status_code == 302)
+        course = Course.query.get(course.id)
+        self.assertTrue(course.term == 3 and course.score == 95)
+
+    def test_catalog(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        rows = [['1', '22000010', '程序设计基础', '-', '核心', '4', '92'],
+                ['2', '22000040', '数据结构', '-', '核心', '3', '80']]
+        Course.bulk_import(u1.id, 1, iter(rows))
+        db.session.rollback()
+        self.assertTrue(len(CatalogCourse.cache) == 0)
+
+        Course.bulk_import(u1.id, 1, iter(rows))
+        db.session.commit()
+        self.assertTrue(CatalogCourse.query.count() == 2)
+        catalog = CatalogCourse.query.filter_by(code='22000010').first()
+        self.assertTrue(CatalogCourse.cache.get(
+            ('22000010', '程序设计基础')) == catalog.id)
+
+        # the second student shares the catalog without looking it up
+        start = len(get_debug_queries())
+        Course.bulk_import(u2.id, 1, iter(rows))
+        db.session.commit()
+        statements = [query.statement
+                      for query in get_debug_queries()[start:]]
+        self.assertTrue(len(statements) > 0)
+        self.assertFalse(any('catalog_courses' in statement
+                             for statement in statements))
+        self.assertTrue(CatalogCourse.query.count() == 2)
+        course = u2.courses.filter_by(catalog_id=catalog.id).first()
+        self.assertTrue(course.name == '程序设计基础')
+        self.assertTrue(course.code == '22000010')
+        self.assertTrue(db.session.execute(
+            db.select([Course.__table__.c.name])
+            .where(Course.__table__.c.id == course.id)).scalar() is None)
+
+        # renaming stores the name on the course only
+        course.name = 'C++程序设计'
+        db.session.commit()
+        self.assertTrue(course.name == 'C++程序设计')
+        self.assertTrue(catalog.name == '程序设计基础')
+        course.name = '程序设计基础'
+        self.assertTrue(course._name is None)
+
+        # the names and codes can be queried whether renamed or not
+        db.session.commit()
+        u1.courses.filter_by(catalog_id=catalog.id).first().name = 'C++'
+        db.session.commit()
+        self.assertTrue(u2.courses.filter(
+            Course.name == '程序设计基础').first() is course)
+        self.assertTrue(u1.courses.filter(Course.name == 'C++').count() == 1)
+        self.assertTrue(Course.query.filter(
+            Course.code == '22000040').count() == 2)
+
+    def test_catalog_race(self):
+        keys = {('22000010', '程序设计基础'): {'credit': 4, 'type_id': 1},
+                ('22000040', '数据结构'): {'credit': 3, 'type_id': 1}}
+        select = CatalogCourse._select
+
+        def racing_select(missing):
+            found = select(missing)
+            if CatalogCourse._select is racing_select:
+                # another transaction creates a key after the SELECT
+                CatalogCourse._select = staticmethod(select)
+                db.session.execute(CatalogCourse.__table__.insert().values(
+                    code='22000010', name='程序设计基础', credit=4,
+                    type_id=1))
+            return found
+
+        CatalogCourse._select = racing_select
+        try:
+            ids = CatalogCourse.lookup(keys)
+        finally:
+            CatalogCourse._select = staticmethod(select)
+        db.session.commit()
+        self.assertTrue(CatalogCourse.query.count() == 2)
+        self.assertTrue(sorted(ids.values()) == sorted(
+            catalog.id for catalog in CatalogCourse.query))
+
+    def test_bulk_delete(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([u1, u2])
+        for u in (u1, u2):
+            for term in (1, 2):
+                for type_id in (CourseType.GENERAL, CourseType.PRO_CORE):
+                    db.session.add(Course(credit=2, score=80, term=term,
+                                          type_id=type_id, user=u))
+        db.session.commit()
+        self.assertTrue(Course.bulk_delete([u1.id], term=1,
+                                           type_id=CourseType.GENERAL) == 1)
+        db.session.commit()
+        self.assertTrue(u1.courses.count() == 3)
+        self.assertTrue(CourseStat.query.get(
+            (u1.id, 1, CourseType.GENERAL)) is None)
+        self.assertTrue(u1.course_stats.count() == 3)
+        self.assertTrue(Course.bulk_delete([u1.id, u2.id]) == 7)
+        db.session.commit()
+        self.assertTrue(u1.courses.count() == 0)
+        self.assertTrue(CourseStat.query.count() == 0)
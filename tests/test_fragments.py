@@ -0,0 +1,80 @@
+import unittest
+
+from app import create_app, db
+from app.models import Comment, Post, Role, User
+
+
+class FragmentCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        Post.fragment_cache.clear()
+        Comment.fragment_cache.clear()
+        self.author = User(email='john@example.com', username='john',
+                           password='cat', confirmed=True)
+        self.reader = User(email='susan@example.org', username='susan',
+                           password='dog', confirmed=True)
+        self.moderator = User(email='david@example.net', username='david',
+                              password='dog', confirmed=True,
+                              role=Role.query.filter_by(
+                                  name='Moderator').first())
+        self.post = Post(body='*hello*', author=self.author)
+        self.comment = Comment(body='first', post=self.post,
+                               author=self.reader)
+        db.session.add_all([self.author, self.reader, self.moderator,
+                            self.post, self.comment])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, url, user=None):
+        client = self.app.test_client(use_cookies=True)
+        if user is not None:
+            client.post('/auth/login', data={'email': user.email,
+                                             'password': 'cat' if user is
+                                             self.author else 'dog'})
+        return client.get(url).get_data(as_text=True)
+
+    def test_post_fragments(self):
+        html = self.get('/blog/index')
+        self.assertTrue('<em>hello</em>' in html)
+        self.assertTrue((self.post.id, 'reader') in Post.fragment_cache)
+        self.assertTrue(self.get('/blog/index') == html)
+
+        # the author sees the edit link in a fragment of their own
+        self.assertTrue('/blog/edit/%d' % self.post.id in
+                        self.get('/blog/index', self.author))
+        self.assertFalse('/blog/edit/%d' % self.post.id in
+                         self.get('/blog/index', self.reader))
+        self.assertTrue(len(Post.fragment_cache) == 2)
+
+        self.post.body = '**changed**'
+        self.assertFalse((self.post.id, 'reader') in Post.fragment_cache)
+        db.session.commit()
+        self.assertTrue('<strong>changed</strong>' in self.get('/blog/index'))
+
+        # a fragment is not reused after a change it was not told about
+        db.session.add(Comment(body='second', post=self.post,
+                               author=self.reader))
+        db.session.commit()
+        self.assertTrue('2 评论' in self.get('/blog/index'))
+
+    def test_comment_fragments(self):
+        url = '/blog/post/%d' % self.post.id
+        self.assertTrue('first' in self.get(url))
+        self.assertTrue('禁止显示' in self.get(url, self.moderator))
+        self.assertTrue(len(Comment.fragment_cache) == 2)
+
+        self.comment.disabled = True
+        self.assertTrue(len(Comment.fragment_cache) == 0)
+        db.session.commit()
+        html = self.get(url)
+        self.assertTrue('这条评论被管理员禁止显示' in html)
+        self.assertFalse('<p>first</p>' in html)
+        self.assertTrue('恢复显示' in self.get(url, self.moderator))
@@ -0,0 +1,58 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import create_app, db
+from app.info.jobs import ImportJob, ImportJobQueue, import_jobs
+from app.models import CatalogCourse, CourseStat, CourseType, User
+from tests.fixtures import transcript
+
+
+class ImportJobTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        CatalogCourse.cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_import_job(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        rows = [('22000%03d' % i, '课程%d' % i, '核心', '2', '90')
+                for i in range(1200)]
+        job = import_jobs.submit(u.id, 3, io.BytesIO(transcript(rows, 'gbk')))
+        self.assertTrue(import_jobs.get(job.id) is job)
+        job.future.result(timeout=60)
+        self.assertTrue(job.status == ImportJob.FINISHED)
+        self.assertTrue(job.to_json()['inserted'] == 1200)
+        self.assertTrue(job.progress == 1.0)
+        self.assertTrue(u.courses.filter_by(term=3).count() == 1200)
+        stat = CourseStat.query.get((u.id, 3, CourseType.PRO_CORE))
+        self.assertTrue(stat.course_count == 1200)
+
+    def test_spool_dir(self):
+        root = tempfile.mkdtemp()
+        self.app.config['APP_IMPORT_SPOOL_DIR'] = root
+        spool_dir = os.path.join(root, 'stuhub-imports')
+        os.makedirs(spool_dir)
+        orphan = os.path.join(spool_dir, 'tmp1234.html')
+        open(orphan, 'w').close()
+        queue = ImportJobQueue()
+        try:
+            self.assertTrue(queue._get_spool_dir(self.app) == spool_dir)
+            self.assertFalse(os.path.exists(orphan))
+            # a second process cannot run import jobs from the same spool
+            with self.assertRaises(RuntimeError):
+                ImportJobQueue()._get_spool_dir(self.app)
+        finally:
+            queue._spool_lock.close()
+            shutil.rmtree(root)
@@ -0,0 +1,121 @@
+import re
+import unittest
+from datetime import datetime, timedelta
+
+from flask_sqlalchemy import get_debug_queries
+
+from app import create_app, db
+from app.models import Comment, Course, Post, Role, User
+from app.pagination import KeysetPagination
+
+
+class KeysetPaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(email='john@example.com', password='cat')
+        db.session.add(self.user)
+        for i in range(47):
+            db.session.add(Course(name='course%d' % i, credit=2, score=80,
+                                  term=i % 8 + 1, type_id=i % 3 + 1,
+                                  user=self.user))
+        db.session.commit()
+        self.keys = [(Course.term, True), (Course.type_id, False),
+                     (Course.id, False)]
+        self.expected = [course.id for course in self.user.courses.order_by(
+            Course.term.desc(), Course.type_id.asc(), Course.id.asc())]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def paginate(self, cursor, total=None):
+        return KeysetPagination(self.user.courses, self.keys, 10, cursor,
+                                total)
+
+    def test_forward_and_backward(self):
+        pages = []
+        pagination = self.paginate(None)
+        self.assertFalse(pagination.has_prev)
+        while True:
+            pages.append([course.id for course in pagination.items])
+            self.assertTrue(pagination.first ==
+                            self.expected.index(pages[-1][0]) + 1)
+            if not pagination.has_next:
+                break
+            pagination = self.paginate(pagination.next_cursor)
+        self.assertTrue(sum(pages, []) == self.expected)
+        self.assertTrue(len(pages) == 5 and len(pages[-1]) == 7)
+        for page in reversed(pages[:-1]):
+            pagination = self.paginate(pagination.prev_cursor)
+            self.assertTrue([course.id for course in pagination.items]
+                            == page)
+            self.assertTrue(pagination.first ==
+                            self.expected.index(page[0]) + 1)
+        self.assertFalse(pagination.has_prev)
+
+    def test_last_page_and_bad_cursor(self):
+        pagination = self.paginate('last')
+        self.assertTrue([course.id for course in pagination.items]
+                        == self.expected[-10:])
+        self.assertFalse(pagination.has_next)
+        self.assertTrue(pagination.has_prev)
+        self.assertTrue(pagination.first is None)
+        pagination = self.paginate('last', total=47)
+        self.assertTrue(pagination.first == 38)
+        self.assertTrue(self.paginate(pagination.prev_cursor).first == 28)
+        pagination = self.paginate('not a cursor')
+        self.assertTrue([course.id for course in pagination.items]
+                        == self.expected[:10])
+
+    def test_timeline(self):
+        other = User(email='susan@example.org', password='dog')
+        db.session.add(other)
+        start = datetime(2018, 1, 1)
+        # posts sharing a timestamp are ordered by their id
+        for i in range(25):
+            db.session.add(Post(body='post %d' % i,
+                                author=self.user if i % 2 else other,
+                                timestamp=start + timedelta(hours=i // 3)))
+        self.user.follow(other)
+        db.session.commit()
+        query, keys = self.user.timeline_query()
+        expected = [post.id for post in self.user.timeline]
+        self.assertTrue(len(expected) == 25)
+        ids = []
+        cursor = None
+        while True:
+            pagination = KeysetPagination(query, keys, 10, cursor)
+            ids += [post.id for post in pagination.items]
+            if not pagination.has_next:
+                break
+            cursor = pagination.next_cursor
+        self.assertTrue(ids == expected)
+
+    def test_comment_floors(self):
+        Role.insert_roles()
+        self.user.confirmed = True
+        self.user.username = 'john'
+        post = Post(body='post', author=self.user)
+        db.session.add(post)
+        for i in range(70):
+            db.session.add(Comment(body='comment %d' % i, post=post,
+                                   author=self.user,
+                                   timestamp=datetime(2018, 1, 1)))
+        db.session.commit()
+        client = self.app.test_client()
+        url = '/blog/post/%d?cursor=last' % post.id
+        for floors in (range(41, 71), range(11, 41), range(1, 11)):
+            start = len(get_debug_queries())
+            html = client.get(url).get_data(as_text=True)
+            self.assertTrue([int(floor) for floor in re.findall(
+                r'(\d+)楼', html)] == list(floors))
+            # the floors come from the cursors, no page counts comments
+            self.assertFalse(any(
+                'count(' in query.statement.lower()
+                for query in get_debug_queries()[start:]))
+            url = re.search(r'href="([^"]*cursor=[^"]*)"', html).group(1) \
+                .replace('&amp;', '&')
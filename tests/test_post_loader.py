@@ -0,0 +1,66 @@
+import unittest
+
+from flask_sqlalchemy import get_debug_queries
+
+from app import create_app, db
+from app.blog.loaders import load_posts
+from app.models import Comment, Post, Role, User
+
+
+class PostLoaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.users = [User(email='user%d@example.com' % i,
+                           username='user%d' % i, password='cat',
+                           confirmed=True) for i in range(4)]
+        db.session.add_all(self.users)
+        db.session.commit()
+        self.client = self.app.test_client(use_cookies=True)
+        self.client.post('/auth/login', data={'email': 'user0@example.com',
+                                              'password': 'cat'})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_posts(self, count):
+        for i in range(count):
+            post = Post(body='post %d' % i, author=self.users[i % 4])
+            db.session.add(post)
+            for j in range(i % 3):
+                db.session.add(Comment(body='comment', post=post,
+                                       author=self.users[j]))
+        db.session.commit()
+
+    def count_queries(self, url):
+        start = len(get_debug_queries())
+        response = self.client.get(url)
+        self.assertTrue(response.status_code == 200)
+        return len(get_debug_queries()) - start
+
+    def test_load_posts(self):
+        self.add_posts(5)
+        posts = load_posts(Post.query.order_by(Post.id))
+        self.assertTrue([post.comment_count for post in posts] ==
+                        [0, 1, 2, 0, 1])
+        self.assertTrue(posts[1].author.username == 'user1')
+        self.assertTrue(posts[1].author.avatar ==
+                        self.users[1].gravatar(size=40))
+        self.assertTrue(load_posts([]) == [])
+
+    def test_fixed_queries(self):
+        self.add_posts(2)
+        post = Post.query.first()
+        urls = ['/blog/index', '/blog/user/user0', '/blog/post/%d' % post.id]
+        few = [self.count_queries(url) for url in urls]
+        self.add_posts(40)
+        for i in range(20):
+            db.session.add(Comment(body='comment', post=post,
+                                   author=self.users[i % 4]))
+        db.session.commit()
+        self.assertTrue([self.count_queries(url) for url in urls] == few)
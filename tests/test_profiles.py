@@ -0,0 +1,84 @@
+import unittest
+
+from app import create_app, db
+from app.models import CatalogCourse, Course, CourseType, User
+from app.profiles import PrefixTrie, UniversityProfile, get_profile
+
+
+class UniversityProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        CatalogCourse.cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_prefix_trie(self):
+        trie = PrefixTrie([('', 0), ('37', 1), ('370', 2), ('5', 3)])
+        self.assertTrue(trie.longest_match('37012') == 2)
+        self.assertTrue(trie.longest_match('3712') == 1)
+        self.assertTrue(trie.longest_match('3') == 0)
+        self.assertTrue(trie.longest_match('500') == 3)
+        self.assertTrue(PrefixTrie([('1', 1)]).longest_match('2') is None)
+
+    def test_nju_classification(self):
+        profile = get_profile()
+        self.assertTrue(profile.name == 'nju')
+        cases = [
+            ('通识', '00000010', 2, CourseType.GENERAL),
+            ('通修', '00000020', 4, CourseType.PUBLIC_BASIC),
+            ('平台', '22000010', 4, CourseType.PRO_BASIC),
+            ('核心', '22000020', 3, CourseType.PRO_CORE),
+            ('选修', '00200010', 0, CourseType.READING),
+            ('选修', '00300010', 2, CourseType.GENERAL),
+            ('选修', '37000010', 2, CourseType.GENERAL),
+            ('选修', '50000010', 2, CourseType.GENERAL),
+            ('选修', '22000030', 2, CourseType.PRO_OPTIONAL),
+            ('公选', '00000030', 2, CourseType.PUBLIC_OPTIONAL),
+        ]
+        for type_name, code, credit, type_id in cases:
+            self.assertTrue(profile.classify(type_name, code, credit) ==
+                            type_id)
+            self.assertTrue(Course.guess_type_id(
+                {'type_name': type_name, 'course_id': code,
+                 'credit': credit}) == type_id)
+        rows = [['1', code, 'course', '', type_name, str(credit), '90']
+                for type_name, code, credit, _ in cases] + [['1', '2']]
+        parsed = profile.parse_rows(rows)
+        self.assertTrue(parsed[-1] is None)
+        self.assertTrue([mapping['type_id'] for mapping in parsed[:-1]] ==
+                        [type_id for _, _, _, type_id in cases])
+
+    def test_custom_profile(self):
+        profile = UniversityProfile(
+            'test',
+            columns={'code': 0, 'name': 1, 'credit': 2, 'score': 3,
+                     'type_name': 4},
+            types={'Core': CourseType.PRO_CORE},
+            default=CourseType.PRO_OPTIONAL,
+            prefixes={'Core': {'MATH': CourseType.PRO_BASIC}})
+        user = User(email='john@example.com', password='cat')
+        db.session.add(user)
+        db.session.commit()
+        result = Course.bulk_import(user.id, 1, [
+            ['MATH101', 'Calculus', '4', '85', 'Core'],
+            ['CS101', 'Programming', '3', 'A', 'Core'],
+            ['ART101', 'Drawing', '2', '90', 'Elective'],
+            ['CS102'],
+        ], profile=profile)
+        self.assertTrue(result == (3, 0, 0, 1))
+        courses = {course.code: course for course in user.courses}
+        self.assertTrue(courses['MATH101'].type_id == CourseType.PRO_BASIC)
+        self.assertTrue(courses['CS101'].type_id == CourseType.PRO_CORE)
+        self.assertTrue(courses['CS101'].score == 0.0)
+        self.assertTrue(courses['ART101'].type_id == CourseType.PRO_OPTIONAL)
+        with self.assertRaises(ValueError):
+            get_profile('unknown')
+        with self.assertRaises(ValueError):
+            UniversityProfile('broken', columns={'code': 0}, types={},
+                              default=CourseType.PRO_OPTIONAL)
@@ -0,0 +1,143 @@
+import unittest
+
+from flask_sqlalchemy import get_debug_queries
+
+from app import create_app, db
+from app.models import (CatalogCourse, Course, CourseScoreBin, Role,
+                        ScoreDistribution, TermPrefixSums, User)
+
+
+class ScoreDistributionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        TermPrefixSums.cache.clear()
+        CatalogCourse.cache.clear()
+        self.users = [User(email='user%d@example.com' % i,
+                           username='user%d' % i, password='cat',
+                           confirmed=True) for i in range(4)]
+        db.session.add_all(self.users)
+        db.session.commit()
+        for user, score in zip(self.users, ('60', '75.5', '90', '100')):
+            Course.bulk_import(user.id, 1, [
+                ['1', '22000010', '程序设计基础', '-', '核心', '4', score]])
+        db.session.commit()
+        self.catalog = CatalogCourse.query.first()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def bins(self):
+        return {score_bin.bin: (score_bin.count, score_bin.score_sum)
+                for score_bin in CourseScoreBin.query.filter_by(
+                    catalog_id=self.catalog.id)}
+
+    def test_distribution(self):
+        distribution = ScoreDistribution()
+        for score in (60, 70, 80, 90, 100.0, 59.9):
+            distribution.counts[ScoreDistribution.bin_of(score)] += 1
+            distribution.score_sum += score
+        self.assertTrue(distribution.count() == 6)
+        self.assertTrue(ScoreDistribution.bin_of(59.9) == 59)
+        self.assertTrue(ScoreDistribution.bin_of(-1) == 0)
+        self.assertTrue(abs(distribution.quantile(0.5) - 71) < 1e-6)
+        self.assertTrue(distribution.quantile(1) == 100)
+        self.assertTrue(abs(distribution.percentile(80) - 100 * 4 / 6) < 1e-6)
+        histogram = distribution.histogram(10)
+        self.assertTrue(len(histogram) == 10)
+        self.assertTrue(histogram[-1] == {'from': 90, 'to': 100, 'count': 2})
+        self.assertTrue(histogram[5]['count'] == 1)
+        self.assertTrue(ScoreDistribution().quantile(0.5) is None)
+
+    def test_incremental_updates(self):
+        self.assertTrue(self.bins() == {60: (1, 60.0), 75: (1, 75.5),
+                                        90: (1, 90.0), 100: (1, 100.0)})
+
+        # re-imports move the score to its new bin
+        Course.bulk_import(self.users[0].id, 1, [
+            ['1', '22000010', '程序设计基础', '-', '核心', '4', '75']])
+        db.session.commit()
+        self.assertTrue(self.bins() == {75: (2, 150.5), 90: (1, 90.0),
+                                        100: (1, 100.0)})
+
+        course = self.users[1].courses.first()
+        course.score = 91
+        db.session.commit()
+        self.assertTrue(self.bins()[75] == (1, 75.0))
+        self.assertTrue(self.bins()[91] == (1, 91.0))
+        db.session.delete(course)
+        db.session.commit()
+        self.assertFalse(91 in self.bins())
+
+        Course.bulk_delete([self.users[2].id])
+        db.session.commit()
+        self.assertTrue(self.bins() == {75: (1, 75.0), 100: (1, 100.0)})
+
+        expected = self.bins()
+        CourseScoreBin.rebuild()
+        db.session.commit()
+        self.assertTrue(self.bins() == expected)
+
+    def test_concurrent_insert(self):
+        existing = CourseScoreBin._existing
+        table = CourseScoreBin.__table__
+
+        def racing_existing(connection, keys):
+            found = existing(connection, keys)
+            if CourseScoreBin._existing is racing_existing:
+                # another transaction creates the bin after the SELECT
+                CourseScoreBin._existing = staticmethod(existing)
+                connection.execute(table.insert().values(
+                    catalog_id=self.catalog.id, bin=50, count=1,
+                    score_sum=50.0))
+            return found
+
+        CourseScoreBin._existing = racing_existing
+        try:
+            CourseScoreBin.apply(db.session.connection(),
+                                 {(self.catalog.id, 50): (2, 101.0)})
+        finally:
+            CourseScoreBin._existing = staticmethod(existing)
+        db.session.commit()
+        self.assertTrue(self.bins()[50] == (3, 151.0))
+        self.assertTrue(self.bins()[60] == (1, 60.0))
+
+    def test_endpoint(self):
+        client = self.app.test_client(use_cookies=True)
+        client.post('/auth/login', data={'email': 'user1@example.com',
+                                         'password': 'cat'})
+        course = self.users[1].courses.first()
+        url = '/info/courses/%d/distribution' % course.id
+        # four students are too few to show how they scored
+        result = client.get(url).get_json()
+        self.assertTrue(result['suppressed'] and result['count'] == 4)
+        self.assertTrue(result['bins'] == [] and result['mean'] is None)
+        self.assertTrue(result['percentile'] is None)
+
+        self.app.config['APP_MIN_COHORT_SIZE'] = 4
+        start = len(get_debug_queries())
+        response = client.get(url)
+        self.assertTrue(response.status_code == 200)
+        self.assertFalse(any(
+            'FROM courses' in query.statement and 'score' in query.statement
+            and 'courses.id =' not in query.statement
+            for query in get_debug_queries()[start:]))
+        result = response.get_json()
+        self.assertTrue(result['count'] == 4)
+        self.assertTrue(abs(result['mean'] - 81.38) < 1e-6)
+        self.assertTrue(result['score'] == 75.5)
+        self.assertTrue(result['percentile'] == 50)
+        self.assertTrue(result['course']['code'] == '22000010')
+        self.assertTrue(result['bins'][7]['count'] == 1)
+
+        response = client.get(url + '?width=50')
+        self.assertTrue(len(response.get_json()['bins']) == 2)
+        self.assertTrue(client.get(url + '?width=0').status_code == 400)
+        other = self.users[0].courses.first()
+        response = client.get('/info/courses/%d/distribution' % other.id)
+        self.assertTrue(response.status_code == 403)
@@ -3,7 +3,8 @@ import unittest
 from datetime import datetime
 
 from app import create_app, db
-from app.models import AnonymousUser, Follow, Permission, Role, User
+from app.models import (AnonymousUser, Comment, Follow, Permission, Post,
+                        Role, TimelineEntry, User)
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -203,3 +204,93 @@ class UserModelTestCase(unittest.TestCase):
         db.session.delete(u2)
         db.session.commit()
         self.assertTrue(Follow.query.count() == 0)
+
+    def test_timeline(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        u3 = User(email='david@example.net', password='dog')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        p1 = Post(body='old post by susan', author=u2,
+                  timestamp=datetime(2018, 1, 1))
+        db.session.add(p1)
+        db.session.commit()
+
+        # following copies the earlier posts
+        u1.follow(u2)
+        u3.follow(u2)
+        db.session.commit()
+        self.assertTrue(u1.timeline.all() == [p1])
+        p2 = Post(body='post by john', author=u1)
+        p3 = Post(body='new post by susan', author=u2)
+        db.session.add_all([p2, p3])
+        db.session.commit()
+        self.assertTrue(set(u1.timeline.all()) == {p1, p2, p3})
+        self.assertTrue(u1.timeline.all()[-1] == p1)
+        self.assertTrue(u3.timeline.all() == [p3, p1])
+        self.assertTrue(TimelineEntry.query.count() == 7)
+
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertTrue(u1.timeline.all() == [p2])
+        db.session.delete(p3)
+        db.session.commit()
+        self.assertTrue(u3.timeline.all() == [p1])
+
+        # authors over the limit are merged in when reading
+        self.app.config['APP_TIMELINE_FAN_OUT_LIMIT'] = 1
+        u1.follow(u2)
+        db.session.commit()
+        p4 = Post(body='popular post by susan', author=u2)
+        db.session.add(p4)
+        db.session.commit()
+        self.assertFalse(u2.fan_out_posts)
+        self.assertTrue(TimelineEntry.query.filter_by(
+            owner_id=u3.id, post_id=p4.id).first() is None)
+        self.assertTrue(u3.timeline.all() == [p4, p1])
+        self.assertTrue(u1.timeline.all()[0] == p4)
+        self.assertTrue(u1.timeline.count() == 3)
+
+    def test_counters(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        post = Post(body='post', author=u1)
+        db.session.add_all([u1, u2, post, Post(body='another', author=u1)])
+        u1.follow(u2)
+        u2.follow(u1)
+        db.session.commit()
+        u2.unfollow(u1)
+        db.session.add_all([Comment(body='comment', post=post, author=u2)
+                            for _ in range(3)])
+        db.session.commit()
+        self.assertTrue((u1.post_count, u1.follower_count,
+                         u1.followed_count) == (2, 0, 1))
+        self.assertTrue((u2.post_count, u2.follower_count,
+                         u2.followed_count) == (0, 1, 0))
+        self.assertTrue(post.comment_count == 3)
+        db.session.delete(post.comments.first())
+        db.session.delete(Post.query.filter_by(body='another').first())
+        db.session.commit()
+        self.assertTrue((u1.post_count, post.comment_count) == (1, 2))
+
+        self.assertTrue(set(User.recount().values()) == {0})
+        u1.follower_count = 5
+        post.comment_count = 7
+        db.session.commit()
+        drifted = User.recount()
+        db.session.commit()
+        self.assertTrue(drifted['users.follower_count'] == 1)
+        self.assertTrue(drifted['posts.comment_count'] == 1)
+        self.assertTrue((u1.follower_count, post.comment_count) == (0, 2))
+
+        # rows written without the counters start them at zero
+        users = User.__table__
+        user_id = db.session.execute(users.insert().values(
+            email='david@example.com')).inserted_primary_key[0]
+        db.session.add(Post(body='post', author_id=user_id))
+        db.session.commit()
+        u3 = User.query.get(user_id)
+        self.assertTrue((u3.post_count, u3.follower_count,
+                         u3.followed_count) == (1, 0, 0))
+        self.assertTrue(Post.query.filter_by(
+            author_id=user_id).first().comment_count == 0)
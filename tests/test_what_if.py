@@ -0,0 +1,102 @@
+import unittest
+
+from app import create_app, db
+from app.models import (Course, CourseStatistics, CourseType, Role,
+                        TermPrefixSums, User)
+
+
+class WhatIfTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        TermPrefixSums.cache.clear()
+        user = User(email='john@example.com', username='john',
+                    password='cat', confirmed=True)
+        db.session.add_all([
+            user,
+            Course(name='math', credit=4, score=80, term=1,
+                   type_id=CourseType.PRO_CORE, user=user),
+            Course(name='art', credit=2, score=95, term=2,
+                   type_id=CourseType.GENERAL, user=user)])
+        db.session.commit()
+        self.client = self.app.test_client(use_cookies=True)
+        self.client.post('/auth/login', data={'email': 'john@example.com',
+                                              'password': 'cat'})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def what_if(self, data):
+        return self.client.post('/info/what-if', json=data)
+
+    def test_required_score(self):
+        stats = CourseStatistics()
+        stats.add(CourseType.PRO_CORE, 4 * 80, 4)
+        self.assertTrue(abs(stats.required_score(4.5, 4) - 100) < 1e-6)
+        self.assertTrue(abs(stats.required_score(
+            4.0, 2, CourseType.academic_type()) - 80) < 1e-6)
+        self.assertTrue(stats.required_score(4.0, 0) is None)
+
+    def test_projection(self):
+        response = self.what_if({'courses': [
+            {'credit': 4, 'score': 90, 'type_id': CourseType.PRO_BASIC}]})
+        self.assertTrue(response.status_code == 200)
+        result = response.get_json()
+        self.assertTrue(abs(result['current']['comprehensive'] -
+                            (320 + 190) / 6 / 20) < 1e-6)
+        self.assertTrue(abs(result['projected']['comprehensive'] -
+                            (320 + 190 + 360) / 10 / 20) < 1e-6)
+        self.assertTrue(abs(result['projected']['academic'] -
+                            (320 + 360) / 8 / 20) < 1e-6)
+        self.assertFalse('required_score' in result)
+
+    def test_target(self):
+        # one scored course, and 4 credits to solve for
+        response = self.what_if({
+            'courses': [
+                {'credit': 2, 'score': 90, 'type_id': CourseType.PRO_CORE},
+                {'credit': 4, 'type_id': CourseType.PRO_CORE},
+                {'credit': 2, 'type_id': CourseType.GENERAL}],
+            'target': 4.25, 'metric': 'academic'})
+        result = response.get_json()
+        # (320 + 180 + 4s) / 10 = 85
+        self.assertTrue(abs(result['required_score'] - 87.5) < 1e-6)
+        self.assertTrue(result['reachable'])
+
+        # without unscored courses, solve for all of them
+        response = self.what_if({
+            'courses': [{'credit': 2, 'score': 60,
+                         'type_id': CourseType.PRO_CORE}],
+            'target': 4.5, 'metric': 'academic'})
+        result = response.get_json()
+        self.assertTrue(abs(result['required_score'] - 110) < 1e-6)
+        self.assertFalse(result['reachable'])
+
+        # general courses do not count towards the academic GPA
+        response = self.what_if({
+            'courses': [{'credit': 2, 'type_id': CourseType.GENERAL}],
+            'target': 4.0, 'metric': 'academic'})
+        self.assertTrue(response.get_json()['required_score'] is None)
+
+    def test_bad_request(self):
+        for data in ({'courses': 'math'},
+                     {'courses': [{'credit': 2}]},
+                     {'courses': [{'credit': -1, 'type_id': 1}]},
+                     {'courses': [], 'target': 6},
+                     {'courses': [], 'metric': 'unknown'},
+                     {'courses': [{'credit': 2, 'type_id': 1}] * 101},
+                     {'courses': [{'credit': 2, 'type_id': 1.5}]},
+                     {'courses': [], 'term_from': 5, 'term_to': 2},
+                     {'courses': [], 'term_from': 1.5}):
+            response = self.what_if(data)
+            self.assertTrue(response.status_code == 400)
+            self.assertTrue('message' in response.get_json())
+        response = self.client.post('/info/what-if', data='not json')
+        self.assertTrue(response.status_code == 400)
+        response = self.client.get('/info/statistics?term_from=5&term_to=2')
+        self.assertTrue(response.status_code == 400)